@@ -19,5 +19,5 @@ setup(
     entry_points=dict(
         console_scripts=['xrlesionfinder=xrlesionfinder.Main:main']
     ),
-    install_requires=["benbiohelpers"]
+    install_requires=["benbiohelpers", "numpy"]
 )
\ No newline at end of file
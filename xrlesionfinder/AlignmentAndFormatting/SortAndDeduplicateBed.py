@@ -0,0 +1,182 @@
+# This script sorts aligned reads in bed format by position (and optionally removes PCR duplicates) without
+# holding the whole file in memory. Reads are sorted in fixed-size runs which are spilled to compressed temporary
+# files and then combined with a k-way merge.
+import os, sys, gzip, heapq
+from operator import itemgetter
+from argparse import Namespace
+from typing import List
+from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs, getTempDir
+from benbiohelpers.CustomErrors import checkIfPathExists, InvalidPathError, UserInputError
+from xrlesionfinder.ProjectManagement.UsefulFileSystemFunctions import getDataDirectory
+
+# The maximum number of spill files merged at once.
+maxMergeFanIn = 64
+
+
+def getSortKey(bedLine: str):
+    "Returns the sort key for a bed line: chromosome, start, end, and strand. (Missing strand info is treated as \".\")"
+    splitLine = bedLine.split('\t', 6)
+    strand = splitLine[5].strip() if len(splitLine) > 5 else '.'
+    return (splitLine[0], int(splitLine[1]), int(splitLine[2].strip()), strand)
+
+
+def getKeyedLineOverhead(bedLine: str):
+    """
+    Returns the memory used to hold the given bed line in a run beyond the line string itself: its (sort key, line)
+    tuple, the sort key and its fields, and the run list's pointer to the tuple.
+    """
+    sortKey = getSortKey(bedLine)
+    return (sys.getsizeof((sortKey, bedLine)) + sys.getsizeof(sortKey) +
+            sum(sys.getsizeof(field) for field in sortKey) + 8)
+
+
+def isHeaderLine(bedLine: str):
+    return bedLine.startswith('#') or bedLine.startswith("track") or bedLine.startswith("browser") or not bedLine.strip()
+
+
+def getKeyedLines(bedLines):
+    "Given an iterable of bed lines, yield (sort key, line) tuples."
+    for bedLine in bedLines: yield (getSortKey(bedLine), bedLine)
+
+
+def getSortedLines(keyedLines, removeDuplicates):
+    """
+    Given an iterable of (sort key, bed line) tuples in sorted order, yield the lines back, skipping duplicates if requested.
+    Duplicates are lines with the same chromosome, start, end, and strand (e.g. PCR duplicates).
+    """
+    previousKey = None
+    for key, bedLine in keyedLines:
+        if removeDuplicates:
+            if key == previousKey: continue
+            previousKey = key
+        yield bedLine
+
+
+def writeRun(keyedLines: List[tuple], runFilePath, removeDuplicates):
+    "Sorts the given (sort key, bed line) tuples and writes the lines to a compressed run file."
+    keyedLines.sort(key = itemgetter(0))
+    with gzip.open(runFilePath, 'wt', compresslevel = 1) as runFile:
+        runFile.writelines(getSortedLines(keyedLines, removeDuplicates))
+
+
+def mergeRuns(runFilePaths: List[str], outputFile, removeDuplicates):
+    "Merges the given sorted run files, writing the results to the given (open) output file."
+    runFiles = [gzip.open(runFilePath, 'rt') for runFilePath in runFilePaths]
+    try:
+        keyedRuns = [getKeyedLines(runFile) for runFile in runFiles]
+        outputFile.writelines(getSortedLines(heapq.merge(*keyedRuns, key = itemgetter(0)), removeDuplicates))
+    finally:
+        for runFile in runFiles: runFile.close()
+
+
+def sortAndDeduplicateBed(bedFilePath, outputFilePath = None, removeDuplicates = True, maxMemoryMB = 1024):
+    """
+    Sort the given bed file by chromosome, start, end, and strand, using no more than (approximately) maxMemoryMB of
+    memory for reads at any one time. If removeDuplicates is True, reads with the same chromosome, start, end, and strand are
+    only written once. If no output file path is given, it is derived from the input file path.
+    Returns the output file path.
+    """
+
+    checkIfPathExists(bedFilePath)
+    if not bedFilePath.endswith(".bed"):
+        raise InvalidPathError(bedFilePath, postPathMessage = "Expected uncompressed bed file.")
+    if maxMemoryMB <= 0: raise UserInputError("Memory cap must be a positive number of megabytes.")
+
+    if outputFilePath is None:
+        if removeDuplicates: outputFilePath = bedFilePath.rsplit(".bed", 1)[0] + "_sorted_deduplicated.bed"
+        else: outputFilePath = bedFilePath.rsplit(".bed", 1)[0] + "_sorted.bed"
+
+    print(f"Sorting {os.path.basename(bedFilePath)}...")
+    maxMemoryBytes = maxMemoryMB*1024*1024
+    tmpDir = getTempDir(bedFilePath)
+    # Temporary file names include the process ID so that concurrent sorts of the same file don't collide.
+    tempFilePathPrefix = os.path.join(tmpDir, os.path.basename(bedFilePath).rsplit(".bed", 1)[0] + f"_{os.getpid()}")
+    runFilePaths: List[str] = list()
+    tempFilePaths: List[str] = list() # Every run file created, so they can all be cleaned up.
+
+    def getTempFilePath(suffix):
+        tempFilePaths.append(tempFilePathPrefix + suffix)
+        return tempFilePaths[-1]
+
+    try:
+
+        # Read the bed file in runs which fit within the memory cap, sorting and spilling each run once it fills up.
+        # If the entire file fits in a single run, it is written straight to the output file instead.
+        # Memory use is measured with sys.getsizeof. The overhead of each line's sort key is measured once, on the first line.
+        keyedLines: List[tuple] = list()
+        keyedLineOverhead = None
+        runBytes = 0
+        with open(bedFilePath, 'r') as bedFile:
+            for bedLine in bedFile:
+                if isHeaderLine(bedLine): continue
+                if not bedLine.endswith('\n'): bedLine += '\n'
+                if keyedLineOverhead is None: keyedLineOverhead = getKeyedLineOverhead(bedLine)
+                keyedLines.append((getSortKey(bedLine), bedLine))
+                runBytes += sys.getsizeof(bedLine) + keyedLineOverhead
+                if runBytes >= maxMemoryBytes:
+                    if not runFilePaths: checkDirs(tmpDir)
+                    runFilePaths.append(getTempFilePath(f"_sort_run_{len(runFilePaths)}.bed.gz"))
+                    writeRun(keyedLines, runFilePaths[-1], removeDuplicates)
+                    keyedLines = list()
+                    runBytes = 0
+
+        if not runFilePaths:
+            keyedLines.sort(key = itemgetter(0))
+            with open(outputFilePath, 'w') as outputFile:
+                outputFile.writelines(getSortedLines(keyedLines, removeDuplicates))
+            return outputFilePath
+
+        if keyedLines:
+            runFilePaths.append(getTempFilePath(f"_sort_run_{len(runFilePaths)}.bed.gz"))
+            writeRun(keyedLines, runFilePaths[-1], removeDuplicates)
+        del keyedLines
+
+        # If there are too many runs to merge at once, merge them in groups until few enough remain.
+        print(f"Merging {len(runFilePaths)} sorted runs...")
+        mergePass = 0
+        while len(runFilePaths) > maxMergeFanIn:
+            mergedRunFilePaths = list()
+            for i in range(0, len(runFilePaths), maxMergeFanIn):
+                mergedRunFilePaths.append(getTempFilePath(f"_sort_merge_{mergePass}_{len(mergedRunFilePaths)}.bed.gz"))
+                with gzip.open(mergedRunFilePaths[-1], 'wt', compresslevel = 1) as mergedRunFile:
+                    mergeRuns(runFilePaths[i:i+maxMergeFanIn], mergedRunFile, removeDuplicates)
+                for runFilePath in runFilePaths[i:i+maxMergeFanIn]: os.remove(runFilePath)
+            runFilePaths = mergedRunFilePaths
+            mergePass += 1
+
+        with open(outputFilePath, 'w') as outputFile:
+            mergeRuns(runFilePaths, outputFile, removeDuplicates)
+
+    # Remove all the run files, even if sorting failed partway through.
+    finally:
+        for tempFilePath in tempFilePaths:
+            if os.path.exists(tempFilePath): os.remove(tempFilePath)
+
+    return outputFilePath
+
+
+def parseArgs(args: Namespace):
+
+    for bedFilePath in args.bedFilePaths:
+        sortAndDeduplicateBed(os.path.abspath(bedFilePath), removeDuplicates = not args.keep_duplicates,
+                              maxMemoryMB = args.max_memory)
+
+
+def main():
+
+    with TkinterDialog(workingDirectory = getDataDirectory(), title = "Sort and Deduplicate Bed Files") as dialog:
+        dialog.createMultipleFileSelector("Bed files of aligned data:", 0, "aligned_reads.bed",
+                                          ("Bed Files", ".bed"))
+        dialog.createCheckbox("Keep duplicate reads", 1, 0)
+        dialog.createTextField("Approximate memory cap (MB):", 2, 0, defaultText = "1024")
+
+    bedFilePaths = dialog.selections.getFilePathGroups()[0]
+    removeDuplicates = not dialog.selections.getToggleStates()[0]
+    maxMemoryMB = int(dialog.selections.getTextEntries()[0])
+
+    for bedFilePath in bedFilePaths:
+        sortAndDeduplicateBed(bedFilePath, removeDuplicates = removeDuplicates, maxMemoryMB = maxMemoryMB)
+
+
+if __name__ == "__main__": main()
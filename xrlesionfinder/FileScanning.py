@@ -0,0 +1,75 @@
+# This script holds the helper functions for quickly scanning large (memory-mapped) fasta and bed files with NumPy.
+# Files are scanned in chunks of complete lines, so no Python strings are created for each line.
+import mmap
+import numpy as np
+
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+TAB = ord('\t')
+FASTA_HEADER_START = ord('>')
+ZERO = ord('0')
+
+# The number of bytes scanned at once by default.
+chunkSize = 64*1024*1024
+
+
+def getFileChunks(fileMap: mmap.mmap, fileBuffer: np.ndarray, scanSize = None, chunkSize = chunkSize):
+    """
+    Yields the start and end of each chunk in the given memory-mapped file along with the chunk itself (as a view of
+    the given buffer). Each chunk is extended to the end of its last line, and a newline is appended to the final chunk
+    (as a copy) if the file doesn't end with one. If scanSize is given, scanning stops after (roughly) that many bytes.
+    """
+
+    fileSize = len(fileBuffer)
+    if scanSize is None: scanSize = fileSize
+    chunkStart = 0
+
+    while chunkStart < scanSize:
+
+        chunkEnd = min(chunkStart + chunkSize, scanSize)
+        if chunkEnd < fileSize:
+            nextNewline = fileMap.find(b'\n', chunkEnd - 1)
+            chunkEnd = fileSize if nextNewline == -1 else nextNewline + 1
+        chunk = fileBuffer[chunkStart:chunkEnd]
+        if chunk[-1] != NEWLINE: chunk = np.append(chunk, np.uint8(NEWLINE))
+
+        yield chunkStart, chunkEnd, chunk
+        chunkStart = chunkEnd
+
+
+def getLineBoundaries(buffer: np.ndarray):
+    "Returns the start and end (exclusive, sans line endings) of every non-empty line in a buffer of complete lines."
+
+    lineEnds = np.flatnonzero(buffer == NEWLINE)
+    lineStarts = np.concatenate(([0], lineEnds[:-1] + 1))
+
+    # Account for windows line endings.
+    if len(lineEnds) > 0:
+        lineEnds = lineEnds - (buffer[np.maximum(lineEnds - 1, 0)] == CARRIAGE_RETURN)
+
+    nonEmpty = lineEnds > lineStarts
+    return lineStarts[nonEmpty], lineEnds[nonEmpty]
+
+
+def parseIntegers(buffer: np.ndarray, fieldStarts: np.ndarray, fieldEnds: np.ndarray):
+    """
+    Parses the non-negative integers stored in the given fields of the buffer.
+    Returns the parsed integers and a boolean mask of which fields were valid integers.
+    Digits are accumulated one column at a time (Horner's method), so memory use scales with the number of fields,
+    not the number of fields times their width.
+    """
+
+    fieldWidths = fieldEnds - fieldStarts
+    if len(fieldWidths) == 0: return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = bool)
+    maxWidth = min(int(fieldWidths.max()), 18)
+
+    values = np.zeros(len(fieldWidths), dtype = np.int64)
+    isValid = (fieldWidths > 0) & (fieldWidths <= maxWidth)
+    for digitOffset in range(maxWidth):
+        inField = digitOffset < fieldWidths
+        digits = buffer[np.where(inField, fieldStarts + digitOffset, 0)] - np.uint8(ZERO)
+        isValid &= ~inField | (digits <= 9)
+        values = np.where(inField, values*10 + digits, values)
+
+    return values, isValid
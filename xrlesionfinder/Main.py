@@ -1,7 +1,7 @@
 # This script will be called from the command line to execute other scripts.
 from argparse import ArgumentParser
 from benbiohelpers.CustomErrors import *
-from xrlesionfinder.AlignmentAndFormatting import AlignXRSeqReads
+from xrlesionfinder.AlignmentAndFormatting import AlignXRSeqReads, SortAndDeduplicateBed
 from xrlesionfinder.ProjectManagement.GenomeManager import GenomeManagerError
 import argparse, importlib.util, sys, traceback
 if importlib.util.find_spec("shtab") is not None: 
@@ -21,6 +21,17 @@ def formatAlignReadsParser(alignReadsParser: ArgumentParser):
     # TODO: Finish this.
 
 
+def formatSortBedParser(sortBedParser: ArgumentParser):
+
+    sortBedParser.set_defaults(func = SortAndDeduplicateBed.parseArgs)
+    sortBedParser.add_argument("bedFilePaths", nargs = '+',
+                               help = "One or more paths to bed files of aligned reads.").complete = fileCompletion
+    sortBedParser.add_argument("-k", "--keep-duplicates", action = "store_true",
+                               help = "Keep reads with identical chromosome, start, end, and strand (e.g. PCR duplicates).")
+    sortBedParser.add_argument("-m", "--max-memory", type = int, default = 1024,
+                               help = "The approximate maximum memory (in MB) used to hold reads while sorting. (Memory is estimated from Python object sizes, so actual use may differ somewhat.)")
+
+
 def getMainParser():
 
     # Initialize the argument parser.
@@ -36,6 +47,11 @@ def getMainParser():
     # For aligning reads...
     alignReadsParser = subparsers.add_parser("alignreads", description = "Align XR-seq reads in preparation for identifying lesions.")
     formatAlignReadsParser(alignReadsParser)
+
+    # For sorting and deduplicating aligned reads...
+    sortBedParser = subparsers.add_parser("sortbed", description = "Sort aligned reads in bed format by position "
+                                                                    "and remove PCR duplicates using limited memory.")
+    formatSortBedParser(sortBedParser)
     
 
     return parser
@@ -41,6 +41,17 @@ class MissingIndexFilesError(GenomeManagerError):
                 f"(e.g. {self.indexPrefixPath}.1.bt2)")
 
 
+class MissingFastaIndexError(GenomeManagerError):
+    "An error class for when a genome fasta file has no accompanying .fai index to read chromosome sizes from."
+    def __init__(self, genomeName: str, faiFilePath: str):
+        self.genomeName = genomeName
+        self.faiFilePath = faiFilePath
+
+    def __str__(self):
+        return (f"No fasta index for {self.genomeName} was found at the expected location: {self.faiFilePath} "
+                 "(Try running \"samtools faidx\" on the genome fasta file.)")
+
+
 def getGenomeListFilePath():
     "Get the path to the file containing the list of known genomes for xrlesionfinder."
     return os.path.join(getExternalDataDirectory(),"genomes.txt")
@@ -51,44 +62,173 @@ def getIndexListFilePath():
     return os.path.join(getExternalDataDirectory(),"genomes_index_path_prefixes.txt")
 
 
+class GenomeEntry:
+    """
+    A known genome, along with cached information about its files.
+    Once the fasta file has been found, it is not checked for again, but a missing fasta file is rechecked every time.
+    Chromosome sizes are read from the fasta index (.fai) file the first time they are requested.
+    """
+
+    def __init__(self, genomeName: str, genomeFastaFilePath: str):
+        self.genomeName = genomeName
+        self.genomeFastaFilePath = genomeFastaFilePath
+        self.genomeFastaFileExists = False
+        self.chromosomeSizes: Dict[str,int] = None
+
+    def checkGenomeFastaFile(self):
+        "Return whether or not the genome fasta file exists. Only a positive result is cached."
+        if not self.genomeFastaFileExists: self.genomeFastaFileExists = os.path.exists(self.genomeFastaFilePath)
+        return self.genomeFastaFileExists
+
+    def getChromosomeSizes(self) -> Dict[str,int]:
+        "Return a dictionary of chromosome sizes with chromosome names as keys."
+        if self.chromosomeSizes is None:
+            faiFilePath = self.genomeFastaFilePath + ".fai"
+            if not os.path.exists(faiFilePath): raise MissingFastaIndexError(self.genomeName, faiFilePath)
+            self.chromosomeSizes = dict()
+            with open(faiFilePath, 'r') as faiFile:
+                for line in faiFile:
+                    chromosome, size = line.split('\t')[:2]
+                    self.chromosomeSizes[chromosome] = int(size)
+        return self.chromosomeSizes
+
+
+class GenomeRegistry:
+    """
+    An in-process cache of the known genomes and bowtie2 index path prefixes.
+    The genome and index list files are only reread when their modification times (or sizes) change,
+    and updates to them are written atomically.
+    """
+
+    def __init__(self):
+        self.genomeListState = None
+        self.genomeEntries: Dict[str,GenomeEntry] = dict()
+        self.indexListState = None
+        self.indexPathPrefixes: Dict[str,str] = dict()
+        self.validIndexPathPrefixes = set()
+
+
+    @staticmethod
+    def getListFileState(listFilePath):
+        "Return a tuple of the given file's modification time and size, or None if it does not exist."
+        try: listFileStat = os.stat(listFilePath)
+        except FileNotFoundError: return None
+        return (listFileStat.st_mtime_ns, listFileStat.st_size)
+
+
+    @staticmethod
+    def readListFile(listFilePath) -> Dict[str,str]:
+        "Read a file of colon-separated genome names and paths into a dictionary."
+        listedPaths = dict()
+        if os.path.exists(listFilePath):
+            with open(listFilePath, 'r') as listFile:
+                for line in listFile:
+                    genomeName,path = line.strip().split(':')
+                    listedPaths[genomeName] = path
+        return listedPaths
+
+
+    @staticmethod
+    def writeListFile(listFilePath, listedPaths: Dict[str,str]):
+        "Atomically (re)write a file of colon-separated genome names and paths from the given dictionary."
+        tempListFilePath = f"{listFilePath}.{os.getpid()}.tmp"
+        with open(tempListFilePath, 'w') as tempListFile:
+            for genomeName in sorted(listedPaths):
+                tempListFile.write(f"{genomeName}:{listedPaths[genomeName]}\n")
+        os.replace(tempListFilePath, listFilePath)
+
+
+    def getGenomeEntries(self) -> Dict[str,GenomeEntry]:
+        "Return the cached genome entries, rereading the genome list file if it has changed."
+        genomeListFilePath = getGenomeListFilePath()
+        genomeListState = self.getListFileState(genomeListFilePath)
+        if genomeListState is None or genomeListState != self.genomeListState:
+            genomes = self.readListFile(genomeListFilePath)
+            # Keep any entries that haven't changed so that their cached information is preserved.
+            self.genomeEntries = {
+                genomeName:(self.genomeEntries[genomeName] if genomeName in self.genomeEntries and
+                            self.genomeEntries[genomeName].genomeFastaFilePath == genomeFastaFilePath
+                            else GenomeEntry(genomeName, genomeFastaFilePath))
+                for genomeName, genomeFastaFilePath in genomes.items()
+            }
+            self.genomeListState = genomeListState
+            # Default index path prefixes are derived from genome fasta file paths, so they need to be checked again.
+            self.validIndexPathPrefixes.clear()
+        return self.genomeEntries
+
+
+    def getIndexPathPrefixes(self) -> Dict[str,str]:
+        "Return the cached index path prefixes, rereading the index list file if it has changed."
+        indexListFilePath = getIndexListFilePath()
+        indexListState = self.getListFileState(indexListFilePath)
+        if indexListState is None or indexListState != self.indexListState:
+            self.indexPathPrefixes = self.readListFile(indexListFilePath)
+            self.indexListState = indexListState
+            self.validIndexPathPrefixes.clear()
+        return self.indexPathPrefixes
+
+
+    def getGenomeEntry(self, genomeName) -> GenomeEntry:
+        "Return the entry for the given genome, making sure its fasta file was found."
+        genomeEntries = self.getGenomeEntries()
+        if genomeName not in genomeEntries: raise UnrecognizedGenomeError(genomeName)
+        genomeEntry = genomeEntries[genomeName]
+        if genomeEntry.checkGenomeFastaFile(): return genomeEntry
+        else: raise MissingGenomeFileError(genomeName, genomeEntry.genomeFastaFilePath)
+
+
+    def getIndexPathPrefix(self, genomeName):
+        """
+        Return the path prefix of the genome's bowtie2 index, checking that the index files exist only once per prefix
+        (until the index or genome list file changes).
+        """
+        indexPathPrefixes = self.getIndexPathPrefixes()
+        if genomeName in indexPathPrefixes: indexPathPrefix = indexPathPrefixes[genomeName]
+        else: indexPathPrefix = self.getGenomeEntry(genomeName).genomeFastaFilePath.rsplit('.',1)[0]
+        if indexPathPrefix in self.validIndexPathPrefixes or os.path.exists(indexPathPrefix+".1.bt2"):
+            self.validIndexPathPrefixes.add(indexPathPrefix)
+            return indexPathPrefix
+        else: raise MissingIndexFilesError(genomeName, indexPathPrefix)
+
+
+    def setGenomes(self, genomes: Dict[str,str]):
+        "Atomically rewrite the genome list file with the given dictionary of genome fasta file paths."
+        self.writeListFile(getGenomeListFilePath(), genomes)
+        self.genomeListState = None
+
+
+    def setIndexPathPrefixes(self, indexPathPrefixes: Dict[str,str]):
+        "Atomically rewrite the index list file with the given dictionary of index path prefixes."
+        self.writeListFile(getIndexListFilePath(), indexPathPrefixes)
+        self.indexListState = None
+
+
+genomeRegistry = GenomeRegistry()
+
+
 def getGenomes() -> Dict[str,str]:
     "Return a dictionary of genome fasta file paths with genome names as keys"
-    genomes = dict()
-    if os.path.exists(getGenomeListFilePath()):
-        with open(getGenomeListFilePath(), 'r') as genomeManagerFile:
-            for line in genomeManagerFile:
-                genomeName,genomeFilePath = line.strip().split(':')
-                genomes[genomeName] = genomeFilePath
-    return genomes
+    return {genomeName:genomeEntry.genomeFastaFilePath for genomeName, genomeEntry in genomeRegistry.getGenomeEntries().items()}
 
 
 def getIndexPathPrefixes() -> Dict[str,str]:
     "Return a dictionary of index path prefixes with genome names as keys"
-    indexPathPrefixes = dict()
-    if os.path.exists(getIndexListFilePath()):
-        with open(getIndexListFilePath(), 'r') as indexListFile:
-            for line in indexListFile:
-                genomeName,indexPathPrefix = line.strip().split(':')
-                indexPathPrefixes[genomeName] = indexPathPrefix
-    return indexPathPrefixes
+    return genomeRegistry.getIndexPathPrefixes().copy()
 
 
 def getGenomeFastaFilePath(genomeName):
     "Return the path to given genome's fasta file"
-    genomes = getGenomes()
-    if genomeName not in genomes: raise UnrecognizedGenomeError(genomeName)
-    genomeFastaFilePath = genomes[genomeName]
-    if os.path.exists(genomeFastaFilePath): return genomeFastaFilePath
-    else: raise MissingGenomeFileError(genomeName, genomeFastaFilePath)
+    return genomeRegistry.getGenomeEntry(genomeName).genomeFastaFilePath
+
+
+def getChromosomeSizes(genomeName) -> Dict[str,int]:
+    "Return a dictionary of the given genome's chromosome sizes (from its .fai index) with chromosome names as keys."
+    return genomeRegistry.getGenomeEntry(genomeName).getChromosomeSizes()
 
 
 def getIndexPathPrefix(genomeName):
     "Return the path prefix of the genome's bowtie2 index."
-    indexPathPrefixes = getIndexPathPrefixes()
-    if genomeName in indexPathPrefixes: indexPathPrefix = indexPathPrefixes[genomeName]
-    else: indexPathPrefix = getGenomeFastaFilePath(genomeName).rsplit('.',1)[0]
-    if os.path.exists(indexPathPrefix+".1.bt2"): return indexPathPrefix
-    else: raise MissingIndexFilesError(genomeName, indexPathPrefix)
+    return genomeRegistry.getIndexPathPrefix(genomeName)
 
 
 def addGenome(genomeFastaFilePath: str, alias = None, indexPath: str = None):
@@ -116,9 +256,7 @@ def addGenome(genomeFastaFilePath: str, alias = None, indexPath: str = None):
     genomes[alias] = genomeFastaFilePath
 
     # Rewrite the genome manager file with the updated dictionary.
-    with open(getGenomeListFilePath(), 'w') as genomeManagerFile:
-        for genomeName in sorted(genomes):
-            genomeManagerFile.write(f"{genomeName}:{genomes[genomeName]}\n")
+    genomeRegistry.setGenomes(genomes)
 
     # Write the custom index path, if given.
     if indexPath is not None:
@@ -140,9 +278,7 @@ def addGenome(genomeFastaFilePath: str, alias = None, indexPath: str = None):
         indexPathPrefixes[alias] = indexPathPrefix
 
         # Rewrite the genome manager file with the updated dictionary.
-        with open(getIndexListFilePath(), 'w') as indexListFile:
-            for genomeName in sorted(indexPathPrefixes):
-                indexListFile.write(f"{genomeName}:{indexPathPrefixes[genomeName]}\n")
+        genomeRegistry.setIndexPathPrefixes(indexPathPrefixes)
 
 
 def main():
@@ -4,14 +4,30 @@ import os
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError
 
+# Caches the data directory (and whether its external data directory has been checked), keyed on the
+# modification time of the text file that stores it. This avoids rereading the text file on every call.
+dataDirectoryCache = {"textFileMTime": None, "dataDirectory": None, "externalDataDirectoryChecked": False}
+
+
+# Returns the modification time of the given file (in nanoseconds), or None if it does not exist.
+def getMTime(filePath):
+    try: return os.stat(filePath).st_mtime_ns
+    except FileNotFoundError: return None
+
+
 # Get the data directory for analyzeXR-seq, creating it from user input if necessary.
 def getDataDirectory():
 
     # Check for the text file which should contain the path to the data directory.
     dataDirectoryTextFilePath = os.path.join(os.getenv("HOME"), ".xrlesionfinder", "data_dir.txt")
 
+    # If the text file hasn't changed since the data directory was last found, just return the cached directory.
+    textFileMTime = getMTime(dataDirectoryTextFilePath)
+    if textFileMTime is not None and textFileMTime == dataDirectoryCache["textFileMTime"]:
+        return dataDirectoryCache["dataDirectory"]
+
     # If it exists, return the directory path within.
-    if os.path.exists(dataDirectoryTextFilePath):
+    if textFileMTime is not None:
         with open(dataDirectoryTextFilePath, 'r') as dataDirectoryTextFile:
             
             dataDirectory = dataDirectoryTextFile.readline().strip()
@@ -21,7 +37,10 @@ def getDataDirectory():
             if not os.path.isdir(dataDirectory):
                 print("Data directory not found at expected location: {}".format(dataDirectory))
                 print("Please select a new location to create a data directory.")
-            else: return dataDirectory
+            else:
+                dataDirectoryCache.update(textFileMTime = textFileMTime, dataDirectory = dataDirectory,
+                                          externalDataDirectoryChecked = False)
+                return dataDirectory
 
     # Create a simple dialog to select a new data directory location.
     # NOTE: The following code is not part of an else statement because the above "if" block will return
@@ -62,5 +81,7 @@ def getDataDirectory():
 def getExternalDataDirectory(): 
     
     externalDataDirectory = os.path.join(getDataDirectory(), "__external_data")
-    checkDirs(externalDataDirectory)
+    if not dataDirectoryCache["externalDataDirectoryChecked"]:
+        checkDirs(externalDataDirectory)
+        dataDirectoryCache["externalDataDirectoryChecked"] = True
     return externalDataDirectory
\ No newline at end of file
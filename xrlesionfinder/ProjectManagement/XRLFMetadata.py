@@ -24,6 +24,9 @@ class DataType(MetadataFeatureValue):
     ALIGNMENT_SAM_FILE = auto(), ('',".sam")
     ALIGNMENT_BAM_FILE = auto(), ('',".bam")
     ALIGNMENT_BED_FILE = auto(), ('',".bed")
+    SORTED_ALIGNMENT_BED_FILE = auto(), ("sorted",".bed")
+    DEDUPLICATED_ALIGNMENT_BED_FILE = auto(), ("sorted_deduplicated",".bed")
+    ALIGNMENT_FASTA_FILE = auto(), ('',".fa")
 
 class XRLFMetadataFeatureID(MetadataFeatureID):
     ALT_ID = auto(), str # e.g. "weird_organism_mystery_lesion_23_days_rrepp_1.5"
@@ -0,0 +1,182 @@
+# This script defines a compact representation for large numbers of reads, shared across xrlesionfinder's pipeline stages.
+# Rather than storing each read as its own Python string, reads are stored as a single contiguous uint8 buffer
+# (e.g. a memory-mapped fasta file) along with arrays of each read's offset into the buffer and length.
+import os, mmap
+import numpy as np
+from typing import Dict, Iterable
+from xrlesionfinder.FileScanning import FASTA_HEADER_START, getFileChunks, getLineBoundaries
+
+
+def getSpanMask(bufferLength, spanStarts: np.ndarray, spanLengths: np.ndarray):
+    """
+    Returns a boolean mask over a buffer of the given length which is True within the given spans.
+    Spans must not overlap one another (e.g. lines in a file).
+    The mask is built from a running sum of span boundaries, so it only takes one byte per buffer byte.
+    """
+    spanMask = np.zeros(bufferLength + 1, dtype = np.int8)
+    spanMask[spanStarts] = 1
+    spanMask[spanStarts + spanLengths] -= 1
+    np.cumsum(spanMask, out = spanMask)
+    return spanMask[:bufferLength].view(bool)
+
+
+class ReadBatch:
+    """
+    Many reads stored as one contiguous uint8 buffer plus arrays of offsets and lengths.
+    Subsets of a batch share its buffer, so they do not copy any sequence data.
+    Optionally, the offsets and lengths of each read's header (e.g. fasta sequence name) in the buffer are also stored.
+    """
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray, lengths: np.ndarray,
+                 headerOffsets: np.ndarray = None, headerLengths: np.ndarray = None):
+        self.buffer = buffer
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.lengths = np.asarray(lengths, dtype = np.int64)
+        assert len(self.offsets) == len(self.lengths), "Read offsets and lengths must have the same number of entries."
+        if headerOffsets is None: self.headerOffsets = self.headerLengths = None
+        else:
+            self.headerOffsets = np.asarray(headerOffsets, dtype = np.int64)
+            self.headerLengths = np.asarray(headerLengths, dtype = np.int64)
+
+
+    @classmethod
+    def fromStrings(cls, sequences: Iterable[str]):
+        "Create a batch from an iterable of sequence strings."
+        sequences = list(sequences)
+        lengths = np.fromiter((len(sequence) for sequence in sequences), dtype = np.int64, count = len(sequences))
+        offsets = np.cumsum(lengths) - lengths
+        buffer = np.frombuffer(''.join(sequences).encode("ascii"), dtype = np.uint8)
+        return cls(buffer, offsets, lengths)
+
+
+    @classmethod
+    def fromFastaFile(cls, fastaFilePath, readSizes = None, keepHeaders = False):
+        """
+        Create a batch from the given (uncompressed) fasta file, optionally keeping only reads with the given lengths.
+        The file is memory-mapped, and when each record's sequence is on a single line (e.g. output from bedToFasta),
+        the batch points directly into the mapped file, so no sequence data is copied.
+        If keepHeaders is True, the location of each read's header (sans ">") is also stored.
+        """
+
+        if os.path.getsize(fastaFilePath) == 0:
+            if keepHeaders: return cls(np.zeros(0, dtype = np.uint8), [], [], [], [])
+            else: return cls(np.zeros(0, dtype = np.uint8), [], [])
+        with open(fastaFilePath, 'rb') as fastaFile:
+            fileMap = mmap.mmap(fastaFile.fileno(), 0, access = mmap.ACCESS_READ)
+        fileBuffer = np.frombuffer(fileMap, dtype = np.uint8)
+
+        # Scan the file in chunks, recording the start, length, and record index of every sequence line.
+        lineStartGroups, lineLengthGroups, recordIndexGroups = list(), list(), list()
+        headerStartGroups, headerLengthGroups = list(), list()
+        headerCount = 0
+        for chunkStart, _, chunk in getFileChunks(fileMap, fileBuffer):
+
+            lineStarts, lineEnds = getLineBoundaries(chunk)
+            isHeader = chunk[lineStarts] == FASTA_HEADER_START
+            recordIndices = headerCount + np.cumsum(isHeader) - 1
+            headerCount += int(np.count_nonzero(isHeader))
+
+            # Sequence lines before the first header (i.e. not part of any record) are ignored.
+            isSequence = ~isHeader & (recordIndices >= 0)
+            if keepHeaders:
+                headerStartGroups.append(lineStarts[isHeader] + chunkStart + 1)
+                headerLengthGroups.append((lineEnds - lineStarts)[isHeader] - 1)
+            lineStartGroups.append(lineStarts[isSequence] + chunkStart)
+            lineLengthGroups.append((lineEnds - lineStarts)[isSequence])
+            recordIndexGroups.append(recordIndices[isSequence])
+
+        lineStarts = np.concatenate(lineStartGroups).astype(np.int64)
+        lineLengths = np.concatenate(lineLengthGroups).astype(np.int64)
+        recordIndices = np.concatenate(recordIndexGroups).astype(np.int64)
+        if keepHeaders:
+            headerStarts = np.concatenate(headerStartGroups).astype(np.int64)
+            headerLengths = np.concatenate(headerLengthGroups).astype(np.int64)
+
+        # If every record is on a single line, the lines themselves are the reads.
+        if len(recordIndices) < 2 or np.all(np.diff(recordIndices) > 0):
+            readBatch = cls(fileBuffer, lineStarts, lineLengths)
+            if keepHeaders:
+                readBatch.headerOffsets = headerStarts[recordIndices]
+                readBatch.headerLengths = headerLengths[recordIndices]
+
+        # Otherwise, join each record's lines into a new, compact buffer.
+        else:
+            recordLengths = np.bincount(recordIndices, weights = lineLengths).astype(np.int64)
+            hasSequence = np.bincount(recordIndices) > 0
+            lengths = recordLengths[hasSequence]
+            offsets = np.cumsum(lengths) - lengths
+            readBatch = cls(fileBuffer[getSpanMask(len(fileBuffer), lineStarts, lineLengths)], offsets, lengths)
+
+            # Since the headers are no longer in the new buffer, append them to it.
+            if keepHeaders:
+                headerStarts, headerLengths = headerStarts[:len(hasSequence)][hasSequence], headerLengths[:len(hasSequence)][hasSequence]
+                readBatch.headerOffsets = len(readBatch.buffer) + np.cumsum(headerLengths) - headerLengths
+                readBatch.headerLengths = headerLengths
+                readBatch.buffer = np.concatenate((readBatch.buffer,
+                                                   fileBuffer[getSpanMask(len(fileBuffer), headerStarts, headerLengths)]))
+
+        if readSizes is not None: readBatch = readBatch.selectLengths(readSizes)
+        return readBatch
+
+
+    @classmethod
+    def fromFileOffsets(cls, filePath, offsets, lengths):
+        """
+        Create a batch of the reads at the given offsets and lengths in the given file, which is memory-mapped.
+        (e.g. to rebuild part of a single-line fasta batch in another process without rescanning the file)
+        """
+        if len(offsets) == 0: return cls(np.zeros(0, dtype = np.uint8), [], [])
+        with open(filePath, 'rb') as file:
+            fileMap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        return cls(np.frombuffer(fileMap, dtype = np.uint8), offsets, lengths)
+
+
+    def __len__(self): return len(self.offsets)
+
+
+    def __getitem__(self, index) -> str:
+        "Return the sequence of the read at the given index as a string."
+        offset = self.offsets[index]
+        return self.buffer[offset:offset + self.lengths[index]].tobytes().decode("ascii")
+
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+
+    def getHeader(self, index) -> str:
+        "Return the header of the read at the given index as a string."
+        assert self.headerOffsets is not None, "Headers were not stored for this read batch."
+        offset = self.headerOffsets[index]
+        return self.buffer[offset:offset + self.headerLengths[index]].tobytes().decode("ascii")
+
+
+    def subset(self, selection):
+        "Return a new batch (sharing this batch's buffer) containing the reads selected by the given index or boolean array."
+        if self.headerOffsets is None: return ReadBatch(self.buffer, self.offsets[selection], self.lengths[selection])
+        return ReadBatch(self.buffer, self.offsets[selection], self.lengths[selection],
+                         self.headerOffsets[selection], self.headerLengths[selection])
+
+
+    def selectLengths(self, readSizes):
+        "Return a new batch (sharing this batch's buffer) containing only reads with the given lengths."
+        return self.subset(np.isin(self.lengths, list(readSizes)))
+
+
+    def splitByLength(self, readSizes) -> Dict[int,"ReadBatch"]:
+        "Return a dictionary of batches (sharing this batch's buffer) for each of the given lengths."
+        return {readSize:self.subset(self.lengths == readSize) for readSize in readSizes}
+
+
+    def getBases(self, positions, fromEnd = False):
+        """
+        Return the bases (as uint8 character codes) at the given 0-based position in each read, along with a boolean array
+        showing which reads actually contain that position. If fromEnd is True, positions are counted backwards from
+        each read's end instead. (i.e. position 0 is the last base.) Reads without the position are given a code of 0.
+        """
+        if fromEnd: positions = self.lengths - 1 - positions
+        else: positions = np.broadcast_to(positions, self.lengths.shape)
+        inRead = (positions >= 0) & (positions < self.lengths)
+        bases = np.zeros(len(self), dtype = np.uint8)
+        bases[inRead] = self.buffer[self.offsets[inRead] + positions[inRead]]
+        return bases, inRead
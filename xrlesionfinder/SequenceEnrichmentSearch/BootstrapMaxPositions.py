@@ -0,0 +1,70 @@
+# This script generates bootstrap statistics for the enriched positions found by FindEnrichedIndices.
+# Replicates are drawn directly from the count arrays for each length bin, so the reads never need to be reread.
+from enum import Enum
+import numpy as np
+
+
+class BootstrapMethod(Enum):
+    """
+    Defines how bootstrap replicates are drawn from the observed counts.
+    - multinomial: Resampling N reads with replacement, so each position's count is binomial with the observed frequency.
+    - poisson: Each read receives a Poisson(1) weight, so each position's count is Poisson with the observed count as its mean.
+      Since the total weight also varies between replicates, frequencies are taken relative to each replicate's total.
+    """
+    multinomial = 1
+    poisson = 2
+
+
+def getBootstrapFrequencies(counts: np.ndarray, readCount: int, replicates, method: BootstrapMethod,
+                            rng: np.random.Generator) -> np.ndarray:
+    """
+    Given an array of feature counts (features x positions) and the number of reads they were counted from, return
+    an array of replicate frequencies with shape (replicates x features x positions).
+    Note that each position is resampled independently from the others.
+    """
+
+    assert method in BootstrapMethod, "Unrecognized bootstrap method: " + str(method)
+    counts = np.asarray(counts)
+    replicateShape = (replicates,) + counts.shape
+
+    if readCount == 0: return np.zeros(replicateShape)
+
+    if method == BootstrapMethod.multinomial:
+        replicateCounts = rng.binomial(readCount, counts / readCount, size = replicateShape)
+        return replicateCounts / readCount
+
+    elif method == BootstrapMethod.poisson:
+        # The weights of the reads with and without each feature are independent, so the replicate's total weight
+        # is the feature's weight plus a separate Poisson draw for the remaining reads.
+        replicateCounts = rng.poisson(counts, size = replicateShape)
+        replicateTotals = replicateCounts + rng.poisson(readCount - counts, size = replicateShape)
+        return np.divide(replicateCounts, replicateTotals, out = np.zeros(replicateShape), where = replicateTotals > 0)
+
+
+def getBootstrapStatistics(counts: np.ndarray, readCount: int, replicates = 2000,
+                           method = BootstrapMethod.multinomial, confidenceLevel = 0.95, rng: np.random.Generator = None):
+    """
+    Given an array of feature counts (features x positions) and the number of reads they were counted from, return
+    a tuple of three arrays, each with the same shape as the counts array:
+    - The lower bound of each position's frequency confidence interval
+    - The upper bound of each position's frequency confidence interval
+    - The fraction of replicates in which each position has the max frequency for its feature.
+      (Ties go to the first position, and replicates where every frequency is 0 are not attributed to any position.)
+    """
+
+    assert 0 < confidenceLevel < 1, "Confidence level must be between 0 and 1."
+    if rng is None: rng = np.random.default_rng()
+
+    replicateFrequencies = getBootstrapFrequencies(counts, readCount, replicates, method, rng)
+
+    # Derive the confidence intervals from the percentiles of the replicate frequencies.
+    tailSize = (1 - confidenceLevel) / 2
+    lowerBounds, upperBounds = np.quantile(replicateFrequencies, (tailSize, 1 - tailSize), axis = 0)
+
+    # Find the max position for every feature in every replicate, and tally how often each position wins.
+    maxIndices = np.argmax(replicateFrequencies, axis = 2)
+    hasNonZeroMax = np.max(replicateFrequencies, axis = 2) > 0
+    isMax = (maxIndices[..., np.newaxis] == np.arange(replicateFrequencies.shape[2])) & hasNonZeroMax[..., np.newaxis]
+    maxProbabilities = np.mean(isMax, axis = 0)
+
+    return (lowerBounds, upperBounds, maxProbabilities)
@@ -0,0 +1,104 @@
+# This script handles the bulk export of base frequencies from FindEnrichedIndices.
+# Frequencies are collected for every sequence length and then formatted and written as whole arrays.
+import numpy as np
+from enum import Enum
+from typing import Dict, List
+
+
+# Frequencies are written with enough significant digits to be read back exactly.
+frequencyFormat = "%.17g"
+
+
+class BulkFrequencyFormat(Enum):
+    """
+    Defines the format used to write bulk frequencies.
+    - wideTSV: One row per sequence length and position, with one frequency column per feature.
+    - longTSV: One row per sequence length, position, and feature (i.e. tidy data).
+    - npz: Compressed NumPy arrays of sequence lengths, positions, features, read counts, and
+      frequencies (sequence length x position x feature).
+    """
+    wideTSV = 1
+    longTSV = 2
+    npz = 3
+
+    def getFileExtension(self):
+        if self == BulkFrequencyFormat.npz: return ".npz"
+        else: return ".tsv"
+
+
+class BulkFrequencyTable:
+    """
+    Collects the frequencies of the given features at the given positions for each sequence length
+    so that they can be written to a file in a single buffered operation.
+    """
+
+    def __init__(self, features: List[str], positions: List[int]):
+
+        self.features = list(features)
+        self.positions = list(positions)
+        self.sequenceLengths: List[int] = list()
+        self.readCounts: List[int] = list()
+        self.frequencies: List[np.ndarray] = list()
+
+
+    # Add the frequencies for a sequence length, given in the format returned by BaseFrequencyTable.getBaseFrequencies.
+    def addFrequencies(self, sequenceLength, readCount, baseFrequencies: Dict[str, Dict[int, float]]):
+
+        self.sequenceLengths.append(sequenceLength)
+        self.readCounts.append(readCount)
+        self.frequencies.append(np.array([[baseFrequencies[feature][position] for feature in self.features]
+                                          for position in self.positions], dtype = float))
+
+
+    # Returns the collected frequencies as an array with dimensions sequence length x position x feature.
+    def getFrequencyArray(self):
+        if self.frequencies: return np.stack(self.frequencies)
+        else: return np.zeros((0, len(self.positions), len(self.features)))
+
+
+    # Writes the collected frequencies in the given format. The file extension is appended to the given prefix.
+    # Returns the path to the new file.
+    def writeFrequencies(self, outputFilePathPrefix, bulkFrequencyFormat = BulkFrequencyFormat.wideTSV):
+
+        assert bulkFrequencyFormat in BulkFrequencyFormat, "Unrecognized bulk frequency format: " + str(bulkFrequencyFormat)
+        outputFilePath = outputFilePathPrefix + bulkFrequencyFormat.getFileExtension()
+        frequencyArray = self.getFrequencyArray()
+
+        if bulkFrequencyFormat == BulkFrequencyFormat.npz:
+            np.savez_compressed(outputFilePath, sequenceLengths = np.array(self.sequenceLengths, dtype = int),
+                                positions = np.array(self.positions, dtype = int), features = np.array(self.features),
+                                readCounts = np.array(self.readCounts, dtype = int), frequencies = frequencyArray)
+            return outputFilePath
+
+        lengthNum, positionNum, featureNum = frequencyArray.shape
+
+        if bulkFrequencyFormat == BulkFrequencyFormat.wideTSV:
+            headers = ["Sequence_Length", "Position"] + [feature + "_Frequency" for feature in self.features]
+            columns = ([np.repeat(np.array(self.sequenceLengths, dtype = int), positionNum),
+                        np.tile(np.array(self.positions, dtype = int), lengthNum)] +
+                       [frequencyArray[:,:,i].ravel() for i in range(featureNum)])
+            formats = ["%d", "%d"] + [frequencyFormat]*featureNum
+
+        elif bulkFrequencyFormat == BulkFrequencyFormat.longTSV:
+            headers = ["Sequence_Length", "Position", "Feature", "Frequency"]
+            columns = [np.repeat(np.array(self.sequenceLengths, dtype = int), positionNum*featureNum),
+                       np.tile(np.repeat(np.array(self.positions, dtype = int), featureNum), lengthNum),
+                       np.tile(np.array(self.features), lengthNum*positionNum),
+                       frequencyArray.ravel()]
+            formats = ["%d", "%d", "%s", frequencyFormat]
+
+        # Format everything in memory, and then write it all at once.
+        with open(outputFilePath, 'w') as outputFile:
+            outputFile.write('\t'.join(headers) + '\n' + formatColumns(columns, formats))
+
+        return outputFilePath
+
+
+def formatColumns(columns: List[np.ndarray], formats: List[str]):
+    "Formats each of the given columns as a whole with np.char.mod, and then joins them into tab-separated lines."
+
+    if len(columns[0]) == 0: return ''
+    lines = np.char.mod(formats[0], columns[0])
+    for column, columnFormat in zip(columns[1:], formats[1:]):
+        lines = np.char.add(np.char.add(lines, '\t'), np.char.mod(columnFormat, column))
+    return '\n'.join(lines.tolist()) + '\n'
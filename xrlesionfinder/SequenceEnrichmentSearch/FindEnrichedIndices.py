@@ -1,11 +1,20 @@
 import os
+import numpy as np
 from enum import Enum
 from typing import Dict, List
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs, getIsolatedParentDir, getTempDir
 from benbiohelpers.FileSystemHandling.BedToFasta import bedToFasta
 from xrlesionfinder.ProjectManagement.UsefulFileSystemFunctions import getDataDirectory
+from xrlesionfinder.ReadBatch import ReadBatch
+from xrlesionfinder.SequenceEnrichmentSearch.BootstrapMaxPositions import BootstrapMethod, getBootstrapStatistics
+from xrlesionfinder.SequenceEnrichmentSearch.BulkFrequencyExport import BulkFrequencyFormat, BulkFrequencyTable
+from xrlesionfinder.SequenceEnrichmentSearch.ReadLengthHistogram import getAutomaticReadSizes, getReadSizesFromHistogram
+from xrlesionfinder.SequenceEnrichmentSearch.ReadPartitioning import PartitionScheme, ReadPartitioner
+
+
+# The number of bootstrap replicates drawn for each length bin when bootstrapping is requested through the UI.
+defaultBootstrapReplicates = 2000
 
 
 class BaseFrequencyTable:
@@ -44,49 +53,93 @@ class BaseFrequencyTable:
             for fromStartValue in self.fromStartValues: self.baseFrequencies[feature][fromStartValue] = 0
             for fromEndValue in self.fromEndValues: self.baseFrequencies[feature][-fromEndValue] = 0
 
-        # Iterate through all the sequences, counting features at each .
-        for sequence in sequences:
+        # Count features at each requested position across all the sequences at once.
+        if not isinstance(sequences, ReadBatch): sequences = ReadBatch.fromStrings(sequences)
+        for fromStartValue in self.fromStartValues:
+            self.countFeaturesAtPosition(sequences, fromStartValue, fromStartValue - 1, fromEnd = False)
+        for fromEndValue in self.fromEndValues:
+            if self.trackedFeature == self.TrackedFeature.singleBase:
+                self.countFeaturesAtPosition(sequences, -fromEndValue, fromEndValue - 1, fromEnd = True)
+            elif self.trackedFeature == self.TrackedFeature.dipys:
+                # Dipys at fromEnd positions start one base further from the end (e.g. -1 covers the last two bases).
+                self.countFeaturesAtPosition(sequences, -fromEndValue, fromEndValue, fromEnd = True)
 
-            # Record all features at requested start values.
-            for fromStartValue in self.fromStartValues:
+        # If the tracked feature is dipys, add a new feature that is the sum of the 4 dipys.
+        if self.trackedFeature == self.TrackedFeature.dipys:
+            for pos in self.baseFrequencies["CC"]:
+                self.baseFrequencies["dipys"][pos] = sum(self.baseFrequencies[dipy][pos] for dipy in ("CC","CT","TT","TC"))
 
-                if self.trackedFeature == self.TrackedFeature.singleBase:
-                    feature = sequence[fromStartValue - 1]
-                elif self.trackedFeature == self.TrackedFeature.dipys:
-                    feature = sequence[fromStartValue - 1:fromStartValue + 1]
-                
-                # This check might be important if we encounter "N"
-                if feature in self.baseFrequencies: self.baseFrequencies[feature][fromStartValue] += 1
+        # Hold on to the raw counts (for bootstrapping) and then convert them to frequencies.
+        self.sequenceNum = len(sequences)
+        self.baseCounts = {feature:self.baseFrequencies[feature].copy() for feature in self.baseFrequencies}
+        self.bootstrapStatistics = None
+        if self.sequenceNum > 0:
+            for feature in self.baseFrequencies:
+                for pos in self.baseFrequencies[feature]:
+                    self.baseFrequencies[feature][pos] = self.baseFrequencies[feature][pos] / self.sequenceNum
 
-            for fromEndValue in self.fromEndValues:
 
-                if self.trackedFeature == self.TrackedFeature.singleBase:
-                    feature = sequence[-fromEndValue]
-                elif self.trackedFeature == self.TrackedFeature.dipys:
-                    # Edge case here because [-2:0] returns nothing, unlike [-2:]
-                    if -fromEndValue == -1: feature = sequence[-fromEndValue-1:]
-                    else: feature = sequence[-fromEndValue - 1:-fromEndValue + 1]
-                
-                # Since we're only counting dipys, make sure this is one of those before counting it!
-                if feature in self.baseFrequencies: self.baseFrequencies[feature][-fromEndValue] += 1
+    # Counts the tracked features in the given reads which start at the given 0-based index (from the start or end of
+    # each read), storing them under the given position key. Reads which don't contain the whole feature aren't counted.
+    # "N" and other unexpected characters are also not counted.
+    def countFeaturesAtPosition(self, readBatch: ReadBatch, positionKey, firstBaseIndex, fromEnd):
 
-        # Convert the raw counts to frequencies.
-        sequenceNum = len(sequences)
-        if sequenceNum > 0:
-            for feature in self.baseFrequencies:
-                for pos in self.baseFrequencies[feature]:
-                    self.baseFrequencies[feature][pos] = self.baseFrequencies[feature][pos] / sequenceNum
+        bases, inRead = readBatch.getBases(firstBaseIndex, fromEnd)
 
-        # If the tracked feature is dipys, add a new feature that is the sum of the 4 dipys.
-        if self.trackedFeature == self.TrackedFeature.dipys:
-            for pos in self.baseFrequencies["CC"]:
-                self.baseFrequencies["dipys"][pos] = sum(self.baseFrequencies[dipy][pos] for dipy in ("CC","CT","TT","TC"))
+        if self.trackedFeature == self.TrackedFeature.singleBase:
+            baseCounts = np.bincount(bases[inRead], minlength = 256)
+            for base in ('A','C','G','T'):
+                self.baseFrequencies[base][positionKey] += int(baseCounts[ord(base)])
+
+        elif self.trackedFeature == self.TrackedFeature.dipys:
+            if fromEnd: nextBases, nextInRead = readBatch.getBases(firstBaseIndex - 1, fromEnd)
+            else: nextBases, nextInRead = readBatch.getBases(firstBaseIndex + 1, fromEnd)
+            isWholeDipy = inRead & nextInRead
+            dipyCounts = np.bincount(bases[isWholeDipy].astype(np.int64)*256 + nextBases[isWholeDipy], minlength = 256*256)
+            for dipy in ("CC","CT","TT","TC"):
+                self.baseFrequencies[dipy][positionKey] += int(dipyCounts[ord(dipy[0])*256 + ord(dipy[1])])
+
+
+    # Generates bootstrap confidence intervals and max position probabilities from the base counts.
+    def generateBootstrapStatistics(self, replicates, method = BootstrapMethod.multinomial,
+                                    confidenceLevel = 0.95, rng: np.random.Generator = None):
+
+        features = list(self.baseCounts)
+        counts = np.array([list(self.baseCounts[feature].values()) for feature in features])
+        lowerBounds, upperBounds, maxProbabilities = getBootstrapStatistics(counts, self.sequenceNum, replicates,
+                                                                            method, confidenceLevel, rng)
+
+        # Store the statistics in dictionaries structured like the base frequencies dictionary.
+        self.bootstrapStatistics: Dict[str, Dict[int, tuple]] = dict()
+        for i, feature in enumerate(features):
+            self.bootstrapStatistics[feature] = {
+                pos:(lowerBounds[i,j], upperBounds[i,j], maxProbabilities[i,j])
+                for j, pos in enumerate(self.baseCounts[feature])
+            }
     
 
     # Given a feature, return a tuple of the frequency of that feature and the position it is present at.
     def getMaxFrequencyAndPos(self, feature, getSecondPlace = False):
 
         if feature == self.TrackedFeature.dipys: feature = "dipys"
+        maxFrequencyPos = self.getMaxFrequencyRawPos(feature, getSecondPlace)
+
+        maxFrequency = self.baseFrequencies[feature][maxFrequencyPos]
+        if maxFrequency == 0: maxFrequencyPos = 0
+        return (maxFrequency, self.formatPos(maxFrequencyPos))
+
+
+    # Given a feature, return a tuple of the lower and upper confidence interval bounds for its max frequency,
+    # and the probability that its max position is the true max. generateBootstrapStatistics must be called first.
+    def getMaxFrequencyBootstrapStatistics(self, feature, getSecondPlace = False):
+
+        if feature == self.TrackedFeature.dipys: feature = "dipys"
+        assert self.bootstrapStatistics is not None, "Bootstrap statistics have not been generated for this base frequency table."
+        return self.bootstrapStatistics[feature][self.getMaxFrequencyRawPos(feature, getSecondPlace)]
+
+
+    # Given a feature, return the (unformatted) position with the max frequency for that feature.
+    def getMaxFrequencyRawPos(self, feature, getSecondPlace = False):
 
         assert feature in self.baseFrequencies, "Requested feature, \"" + feature + "\", is not available for this base frequency table."
 
@@ -98,9 +151,7 @@ class BaseFrequencyTable:
             sansMaxBaseFrequencies.pop(maxFrequencyPos)
             maxFrequencyPos = max(sansMaxBaseFrequencies, key = self.baseFrequencies[feature].get)
 
-        maxFrequency = self.baseFrequencies[feature][maxFrequencyPos]
-        if maxFrequency == 0: maxFrequencyPos = 0
-        return (maxFrequency, self.formatPos(maxFrequencyPos))
+        return maxFrequencyPos
 
 
     # For tracked dipys, converts the position to a "half-base" position.  For single base positions, just returns the original position.
@@ -117,29 +168,32 @@ class BaseFrequencyTable:
     def getBaseFrequencies(self): return self.baseFrequencies
 
 
-# Reads the given fasta file line by line and filters out any reads of inappropriate length.  
-# Returns a dictionary of lists of sequences by length
-def getReadSequencesByLength(fastaFilePath, readSizeRange):
+# Reads the given fasta file into a ReadBatch and filters out any reads of inappropriate length.
+# Returns a dictionary of ReadBatch objects by length (all sharing the same underlying buffer).
+def getReadSequencesByLength(fastaFilePath, readSizeRange) -> Dict[int,ReadBatch]:
+    return ReadBatch.fromFastaFile(fastaFilePath, readSizeRange).splitByLength(readSizeRange)
 
-    # Initialize the dictionary
-    sequencesByLength: Dict[int,List[str]] = dict()
-    for readSize in readSizeRange: sequencesByLength[readSize] = list()
 
-    # Populate the dictionary with sequences of appropriate lenth.
-    with open(fastaFilePath, 'r') as fastaFile:
-        for fastaEntry in FastaFileIterator(fastaFile):
+# Converts the given bed file to fasta format in a temporary directory alongside it.
+# Returns the path to the new fasta file.
+def convertBedToTempFasta(bedFilePath, genomeFastaFilePath):
 
-            sequenceLength = len(fastaEntry.sequence)
-            if sequenceLength in readSizeRange:
-                sequencesByLength[sequenceLength].append(fastaEntry.sequence)
+    tmpDir = getTempDir(bedFilePath)
+    checkDirs(tmpDir)
+    fastaBasename = os.path.basename(bedFilePath).rsplit('.',1)[0] + ".fa"
+    fastaOutputFilePath = os.path.join(tmpDir,fastaBasename)
 
-    return sequencesByLength
+    bedToFasta(bedFilePath, genomeFastaFilePath, fastaOutputFilePath)
+    return fastaOutputFilePath
 
 
 def findEnrichedIndices(bedFilePaths: List[str], genomeFastaFilePath, fastaFilePaths: List[str],
                         countIndividualBases, countDipys, getSecondPlace,
                         readSizeRange = range(16,36), fromStartValues = range(0,0), fromEndValues = range(1,16),
-                        outputBulkFrequencies = False):
+                        outputBulkFrequencies = False, bulkFrequencyFormat = BulkFrequencyFormat.wideTSV, bootstrapReplicates = 0,
+                        bootstrapMethod = BootstrapMethod.multinomial, confidenceLevel = 0.95, randomSeed = None,
+                        readSizeCoverageFraction = 0.95, minReadsPerLength = 0, histogramSampleSizeMB = None,
+                        annotationBedFilePath = None, partitionScheme = PartitionScheme.region):
     """
     Given one or more fasta files and the features to count, find which indices are enriched for each sequence length.
     Right now, the search is restricted to specific read size ranges and positions relative to the sequence start and end:
@@ -148,27 +202,58 @@ def findEnrichedIndices(bedFilePaths: List[str], genomeFastaFilePath, fastaFileP
     - fromEndValues specifies the 1-based positions from the 3- end that will be analyzed.
     - Default values reflect reasonable contraints for human XR-seq reads.
 
-    Unfortunately, the code is pretty brittle at the moment. (e.g., depending on the above values, it may try to look up string indices that do not exist.)
-    It is also very memory inefficient, due to reading all the valid fasta sequences into a dictionary at runtime... but it does the job!
-    If I ever need to scale up this kind of analysis though, it may be better to redesign the core algorithm...
+    If readSizeRange is None, it is instead chosen for each file from a read length histogram as the smallest range
+    covering readSizeCoverageFraction of the reads. For bed files, the histogram comes from a quick scan of the bed file
+    before it is converted to fasta format. (If histogramSampleSizeMB is given, only that much of each bed file is scanned.)
+    For fasta files, it is built from the lengths of the reads as they are read in for counting.
+    Read sizes with fewer than minReadsPerLength reads are skipped entirely. (By default, minReadsPerLength is 0, so none are skipped.)
+
+    If outputBulkFrequencies is True, the frequencies of every feature at every position are also written in the given
+    bulkFrequencyFormat.
+
+    If bootstrapReplicates is greater than 0, that many bootstrap replicates are drawn from each length bin's counts
+    (using bootstrapMethod) to give confidence intervals for each max frequency (at the given confidenceLevel) and
+    the probability that each max position is the most frequent one. These are written to the _enriched_indices.tsv file as:
+    - <feature>_Max_Frequency_CI_Lower and <feature>_Max_Frequency_CI_Upper: The confidence interval for the max frequency.
+    - <feature>_Max_Position_Probability: The fraction of replicates in which the max position had the highest frequency.
+    - <feature>_Next_Max_Frequency_CI_Lower, <feature>_Next_Max_Frequency_CI_Upper, and <feature>_Next_Max_Position_Probability:
+      The same values for the second place position, if requested.
+    Note that each position is resampled independently, ignoring the correlation between positions within the same reads,
+    so the position probabilities are approximate.
+
+    If annotationBedFilePath is given, reads are partitioned by their overlap with the annotated regions (and by strand,
+    depending on the partitionScheme), and a separate set of output files is written for each partition.
+    This requires fasta headers giving each read's location (e.g. "chr1:100-130(+)"), as produced from bed files.
+
+    Reads are held in a compact ReadBatch (backed by the memory-mapped fasta file) and counted with vectorized NumPy operations.
+    Positions which fall outside a read are simply not counted for that read.
     """
 
+    # Set up the random number generator for bootstrapping.
+    if bootstrapReplicates > 0: rng = np.random.default_rng(randomSeed)
+
+    # If requested, index the annotation regions used to partition reads.
+    if annotationBedFilePath is None: readPartitioner = None
+    else: readPartitioner = ReadPartitioner(annotationBedFilePath, partitionScheme)
+
     # Create a list of all searched positions.
     allSearchValues = list(fromStartValues) + ([-value for value in fromEndValues][::-1])
 
-    # First, convert any bed file paths to fasta format.
+    # Read sizes are chosen automatically if no range is given or if sparse read sizes should be skipped.
+    chooseReadSizes = readSizeRange is None or minReadsPerLength > 0
+    readSizesByFastaFilePath: Dict[str, List[int]] = dict()
+
+    # First, convert any bed file paths to fasta format. If read sizes are chosen automatically, the (cheaper) bed files
+    # are scanned for read lengths first.
     print("Converting bed files to fasta format...")
     newFastaFilePaths = list()
     for bedFilePath in bedFilePaths:
-
+        if chooseReadSizes:
+            bedReadSizes = getAutomaticReadSizes([bedFilePath], readSizeRange, readSizeCoverageFraction,
+                                                 minReadsPerLength, histogramSampleSizeMB)
         print(f"Converting {os.path.basename(bedFilePath)}...")
-        tmpDir = getTempDir(bedFilePath)
-        checkDirs(tmpDir)
-        fastaBasename = os.path.basename(bedFilePath).rsplit('.',1)[0] + ".fa"
-        fastaOutputFilePath = os.path.join(tmpDir,fastaBasename)
-        newFastaFilePaths.append(fastaOutputFilePath)
-
-        bedToFasta(bedFilePath, genomeFastaFilePath, fastaOutputFilePath)
+        newFastaFilePaths.append(convertBedToTempFasta(bedFilePath, genomeFastaFilePath))
+        if chooseReadSizes: readSizesByFastaFilePath[newFastaFilePaths[-1]] = bedReadSizes
     
     # Add any new fasta file paths to the current list and then use them to search for enriched indices.
     fastaFilePaths += newFastaFilePaths
@@ -181,98 +266,136 @@ def findEnrichedIndices(bedFilePaths: List[str], genomeFastaFilePath, fastaFileP
         if getIsolatedParentDir(fastaFilePath) == ".tmp":
             outputDir = os.path.dirname(os.path.dirname(fastaFilePath))
         else: outputDir = os.path.dirname(fastaFilePath)
-        outputBasename = os.path.basename(fastaFilePath).rsplit('.',1)[0] + "_enriched_indices.tsv"
-        enrichedIndicesOutputFilePath = os.path.join(outputDir,outputBasename)
-
-        if outputBulkFrequencies:
-            if countIndividualBases:
-                individualFrequenciesOutputFilePath = os.path.join(outputDir, os.path.basename(fastaFilePath).rsplit('.',1)[0] + "_individual_nuc_frequencies.tsv")
-                individualFrequenciesOutputFile = open(individualFrequenciesOutputFilePath, 'w')
-                individualFrequenciesOutputFile.write('\t'.join(("Sequence_Length", "Position", "A_Frequency", "C_Frequency", "G_Frequency", "T_Frequency")) + '\n')
-            if countDipys:
-                dipyFrequenciesOutputFilePath = os.path.join(outputDir, os.path.basename(fastaFilePath).rsplit('.',1)[0] + "_dipy_frequencies.tsv")
-                dipyFrequenciesOutputFile = open(dipyFrequenciesOutputFilePath, 'w')
-                dipyFrequenciesOutputFile.write('\t'.join(("Sequence_Length", "Position", "CC_Frequency", "CT_Frequency", "TC_Frequency", "TT_Frequency")) + '\n')
-
-        # Get a dictionary of sequences with lengths within readSizeRange. (This is horribly memory inefficient...)
+        outputBasename = os.path.basename(fastaFilePath).rsplit('.',1)[0]
+
+        # Read in the sequences. If read sizes need to be chosen from this file's reads, read in every read and
+        # choose them from the read length histogram.
         print("Reading in sequences and binning by length...")
-        sequencesByLength = getReadSequencesByLength(fastaFilePath, readSizeRange)
-
-        # Next, prepare a dictionary to hold the final enriched indices info
-        enrichedIndicesInfo: Dict[int,Dict[str,tuple]] = dict()
-        if getSecondPlace: enrichedIndicesInfoSP: Dict[int,Dict[str,tuple]] = dict() # The "second place" dictionary.
-
-        # For each sequence length, prepare a list of the enriched indices for each requested feature, as well as their frequency.
-        print("Finding enriched indices for each sequence length bin...")
-        for sequenceLength in readSizeRange:
-            print("Working with sequences of length",sequenceLength)
-            enrichedIndicesInfo[sequenceLength] = dict()
-            if getSecondPlace: enrichedIndicesInfoSP[sequenceLength] = dict()
-
-            if countIndividualBases:
-                individualBaseFrequencyTable = BaseFrequencyTable(fromStartValues, fromEndValues, BaseFrequencyTable.TrackedFeature.singleBase)
-                individualBaseFrequencyTable.generateBaseFrequencyTable(sequencesByLength[sequenceLength])
-                for base in ('A','C','G','T'):
-                    if getSecondPlace: enrichedIndicesInfoSP[sequenceLength][base] = individualBaseFrequencyTable.getMaxFrequencyAndPos(base, getSecondPlace)
-                    enrichedIndicesInfo[sequenceLength][base] = individualBaseFrequencyTable.getMaxFrequencyAndPos(base)
+        if not chooseReadSizes: readSizes = readSizeRange
+        else: readSizes = readSizesByFastaFilePath.get(fastaFilePath)
+        readBatch = ReadBatch.fromFastaFile(fastaFilePath, readSizes, keepHeaders = readPartitioner is not None)
+        if readSizes is None:
+            readSizes = getReadSizesFromHistogram(np.bincount(readBatch.lengths), readSizeRange,
+                                                  readSizeCoverageFraction, minReadsPerLength)
+            readBatch = readBatch.selectLengths(readSizes)
+        if not readSizes:
+            print("No read sizes to analyze. Skipping.")
+            continue
+
+        # Get a dictionary of sequences with lengths within readSizes, split into partitions if requested.
+        # (The file is only read and partitioned once, but features are then counted separately for each partition.)
+        if readPartitioner is None:
+            partitionedSequencesByLength = {None:readBatch.splitByLength(readSizes)}
+        else:
+            print("Partitioning reads...")
+            partitionedReads = readPartitioner.partitionReads(readBatch)
+            partitionedSequencesByLength = {partition:partitionedReads[partition].splitByLength(readSizes)
+                                            for partition in partitionedReads}
+
+        for partition, sequencesByLength in partitionedSequencesByLength.items():
+
+            if partition is None: outputFilePathPrefix = os.path.join(outputDir, outputBasename)
+            else:
+                print()
+                print("Working with partition:", partition)
+                outputFilePathPrefix = os.path.join(outputDir, outputBasename + '_' + partition)
+            enrichedIndicesOutputFilePath = outputFilePathPrefix + "_enriched_indices.tsv"
+
+            if outputBulkFrequencies:
+                if countIndividualBases:
+                    individualFrequenciesOutputFilePrefix = outputFilePathPrefix + "_individual_nuc_frequencies"
+                    individualBulkFrequencyTable = BulkFrequencyTable(('A','C','G','T'), allSearchValues)
+                if countDipys:
+                    dipyFrequenciesOutputFilePrefix = outputFilePathPrefix + "_dipy_frequencies"
+                    dipyBulkFrequencyTable = BulkFrequencyTable(("CC","CT","TC","TT"), allSearchValues)
+
+            # Next, prepare a dictionary to hold the final enriched indices info
+            enrichedIndicesInfo: Dict[int,Dict[str,tuple]] = dict()
+            if getSecondPlace: enrichedIndicesInfoSP: Dict[int,Dict[str,tuple]] = dict() # The "second place" dictionary.
+
+            # For each sequence length, prepare a list of the enriched indices for each requested feature, as well as their frequency.
+            print("Finding enriched indices for each sequence length bin...")
+            for sequenceLength in readSizes:
+                print("Working with sequences of length",sequenceLength)
+                enrichedIndicesInfo[sequenceLength] = dict()
+                if getSecondPlace: enrichedIndicesInfoSP[sequenceLength] = dict()
+
+                if countIndividualBases:
+                    individualBaseFrequencyTable = BaseFrequencyTable(fromStartValues, fromEndValues, BaseFrequencyTable.TrackedFeature.singleBase)
+                    individualBaseFrequencyTable.generateBaseFrequencyTable(sequencesByLength[sequenceLength])
+                    if bootstrapReplicates > 0:
+                        individualBaseFrequencyTable.generateBootstrapStatistics(bootstrapReplicates, bootstrapMethod, confidenceLevel, rng)
+                    for base in ('A','C','G','T'):
+                        if getSecondPlace: enrichedIndicesInfoSP[sequenceLength][base] = individualBaseFrequencyTable.getMaxFrequencyAndPos(base, getSecondPlace)
+                        enrichedIndicesInfo[sequenceLength][base] = individualBaseFrequencyTable.getMaxFrequencyAndPos(base)
+                        if bootstrapReplicates > 0:
+                            if getSecondPlace: enrichedIndicesInfoSP[sequenceLength][base] += individualBaseFrequencyTable.getMaxFrequencyBootstrapStatistics(base, getSecondPlace)
+                            enrichedIndicesInfo[sequenceLength][base] += individualBaseFrequencyTable.getMaxFrequencyBootstrapStatistics(base)
                 
-                # If requested, write the individual frequencies.
-                if outputBulkFrequencies:
-                    for searchValue in allSearchValues:
-                        individualFrequenciesOutputFile.write('\t'.join((str(sequenceLength), str(searchValue),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['A'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['C'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['G'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['T'][searchValue]),
-                        )) + '\n')
+                    # If requested, record the individual frequencies.
+                    if outputBulkFrequencies:
+                        individualBulkFrequencyTable.addFrequencies(sequenceLength, len(sequencesByLength[sequenceLength]),
+                                                                    individualBaseFrequencyTable.getBaseFrequencies())
                 
             
-            if countDipys:
-                dipyFrequencyTable = BaseFrequencyTable(fromStartValues, fromEndValues, BaseFrequencyTable.TrackedFeature.dipys)
-                dipyFrequencyTable.generateBaseFrequencyTable(sequencesByLength[sequenceLength])
-                if getSecondPlace:
-                    enrichedIndicesInfoSP[sequenceLength]["dipys"] = dipyFrequencyTable.getMaxFrequencyAndPos(BaseFrequencyTable.TrackedFeature.dipys, getSecondPlace)
-                enrichedIndicesInfo[sequenceLength]["dipys"] = dipyFrequencyTable.getMaxFrequencyAndPos(BaseFrequencyTable.TrackedFeature.dipys)
-
-                # If requested, write the individual counts.
-                if outputBulkFrequencies:
-                    for searchValue in allSearchValues:
-                        individualFrequenciesOutputFile.write('\t'.join((str(sequenceLength), str(searchValue),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['CC'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['CT'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['TC'][searchValue]),
-                                                                    str(individualBaseFrequencyTable.baseFrequencies['TT'][searchValue]),
-                        )) + '\n')
-
-        # Close bulk frequency ouptut file paths as necessary.
-        if outputBulkFrequencies and countIndividualBases: individualFrequenciesOutputFile.close()
-        if outputBulkFrequencies and countDipys: dipyFrequenciesOutputFile.close()
-
-        # Now, write the results to the output file!
-        print("Writing Results...")
-        with open(enrichedIndicesOutputFilePath, 'w') as enrichedIndicesOutputFile:
-
-            # Write the header
-            enrichedIndicesOutputFile.write("Sequence_Length" + '\t' + "Read_Count")
-            for feature in enrichedIndicesInfo[readSizeRange[0]]:
-                enrichedIndicesOutputFile.write('\t' + feature + "_Max_Frequency" + '\t' + feature + "_Max_Frequency_Position")
-                if getSecondPlace: enrichedIndicesOutputFile.write('\t' + feature + "_Next_Max_Frequency" + '\t' + 
-                                                                   feature + "_Next_Max_Frequency_Position" + '\t' + feature + "_Max_to_Next_Max_Diff")
-            enrichedIndicesOutputFile.write('\n')
-
-            # Write everything else!
-            for sequenceLength in readSizeRange:
-                enrichedIndicesOutputFile.write(str(sequenceLength) + '\t' + str(len(sequencesByLength[sequenceLength])))
-                for feature in enrichedIndicesInfo[sequenceLength]:
-                    maxFrequencyInfo = enrichedIndicesInfo[sequenceLength][feature]
-                    enrichedIndicesOutputFile.write('\t' + str(maxFrequencyInfo[0]) + '\t' + str(maxFrequencyInfo[1]))
-
-                    if getSecondPlace: 
-                        nextMaxFrequencyInfo = enrichedIndicesInfoSP[sequenceLength][feature]
-                        enrichedIndicesOutputFile.write('\t' + str(nextMaxFrequencyInfo[0]) + '\t' + str(nextMaxFrequencyInfo[1]) +
-                                                        '\t' + str(maxFrequencyInfo[0] - nextMaxFrequencyInfo[0]))
+                if countDipys:
+                    dipyFrequencyTable = BaseFrequencyTable(fromStartValues, fromEndValues, BaseFrequencyTable.TrackedFeature.dipys)
+                    dipyFrequencyTable.generateBaseFrequencyTable(sequencesByLength[sequenceLength])
+                    if bootstrapReplicates > 0:
+                        dipyFrequencyTable.generateBootstrapStatistics(bootstrapReplicates, bootstrapMethod, confidenceLevel, rng)
+                    if getSecondPlace:
+                        enrichedIndicesInfoSP[sequenceLength]["dipys"] = dipyFrequencyTable.getMaxFrequencyAndPos(BaseFrequencyTable.TrackedFeature.dipys, getSecondPlace)
+                    enrichedIndicesInfo[sequenceLength]["dipys"] = dipyFrequencyTable.getMaxFrequencyAndPos(BaseFrequencyTable.TrackedFeature.dipys)
+                    if bootstrapReplicates > 0:
+                        if getSecondPlace:
+                            enrichedIndicesInfoSP[sequenceLength]["dipys"] += dipyFrequencyTable.getMaxFrequencyBootstrapStatistics(BaseFrequencyTable.TrackedFeature.dipys, getSecondPlace)
+                        enrichedIndicesInfo[sequenceLength]["dipys"] += dipyFrequencyTable.getMaxFrequencyBootstrapStatistics(BaseFrequencyTable.TrackedFeature.dipys)
+
+                    # If requested, record the dipy frequencies.
+                    if outputBulkFrequencies:
+                        dipyBulkFrequencyTable.addFrequencies(sequenceLength, len(sequencesByLength[sequenceLength]),
+                                                              dipyFrequencyTable.getBaseFrequencies())
+
+            # Write bulk frequencies as necessary.
+            if outputBulkFrequencies and countIndividualBases:
+                individualBulkFrequencyTable.writeFrequencies(individualFrequenciesOutputFilePrefix, bulkFrequencyFormat)
+            if outputBulkFrequencies and countDipys:
+                dipyBulkFrequencyTable.writeFrequencies(dipyFrequenciesOutputFilePrefix, bulkFrequencyFormat)
+
+            # Now, write the results to the output file!
+            print("Writing Results...")
+            with open(enrichedIndicesOutputFilePath, 'w') as enrichedIndicesOutputFile:
+
+                # Write the header
+                enrichedIndicesOutputFile.write("Sequence_Length" + '\t' + "Read_Count")
+                for feature in enrichedIndicesInfo[readSizes[0]]:
+                    enrichedIndicesOutputFile.write('\t' + feature + "_Max_Frequency" + '\t' + feature + "_Max_Frequency_Position")
+                    if bootstrapReplicates > 0: enrichedIndicesOutputFile.write('\t' + feature + "_Max_Frequency_CI_Lower" + '\t' +
+                                                                                feature + "_Max_Frequency_CI_Upper" + '\t' + feature + "_Max_Position_Probability")
+                    if getSecondPlace: enrichedIndicesOutputFile.write('\t' + feature + "_Next_Max_Frequency" + '\t' + 
+                                                                       feature + "_Next_Max_Frequency_Position" + '\t' + feature + "_Max_to_Next_Max_Diff")
+                    if getSecondPlace and bootstrapReplicates > 0:
+                        enrichedIndicesOutputFile.write('\t' + feature + "_Next_Max_Frequency_CI_Lower" + '\t' + feature + "_Next_Max_Frequency_CI_Upper" +
+                                                        '\t' + feature + "_Next_Max_Position_Probability")
                 enrichedIndicesOutputFile.write('\n')
 
+                # Write everything else!
+                for sequenceLength in readSizes:
+                    enrichedIndicesOutputFile.write(str(sequenceLength) + '\t' + str(len(sequencesByLength[sequenceLength])))
+                    for feature in enrichedIndicesInfo[sequenceLength]:
+                        maxFrequencyInfo = enrichedIndicesInfo[sequenceLength][feature]
+                        enrichedIndicesOutputFile.write('\t' + str(maxFrequencyInfo[0]) + '\t' + str(maxFrequencyInfo[1]))
+                        if bootstrapReplicates > 0:
+                            enrichedIndicesOutputFile.write(''.join('\t' + str(statistic) for statistic in maxFrequencyInfo[2:]))
+
+                        if getSecondPlace: 
+                            nextMaxFrequencyInfo = enrichedIndicesInfoSP[sequenceLength][feature]
+                            enrichedIndicesOutputFile.write('\t' + str(nextMaxFrequencyInfo[0]) + '\t' + str(nextMaxFrequencyInfo[1]) +
+                                                            '\t' + str(maxFrequencyInfo[0] - nextMaxFrequencyInfo[0]))
+                            if bootstrapReplicates > 0:
+                                enrichedIndicesOutputFile.write(''.join('\t' + str(statistic) for statistic in nextMaxFrequencyInfo[2:]))
+                    enrichedIndicesOutputFile.write('\n')
+
 
 def main():
 
@@ -286,6 +409,15 @@ def main():
         dialog.createCheckbox("Count dipys", 3, 1)
         dialog.createCheckbox("Record second-most enriched positions", 4, 0)
         dialog.createCheckbox("Output bulk frequencies", 4, 1)
+        dialog.createCheckbox("Bootstrap max position confidence", 5, 0)
+        dialog.createDropdown("Bulk frequency format:", 6, 0, ("Wide TSV", "Long TSV", "NPZ"))
+        dialog.createCheckbox("Automatically choose read lengths", 7, 0)
+        dialog.createTextField("Min reads per length:", 7, 1, defaultText = "0")
+        with dialog.createDynamicSelector(8, 0, 2) as partitionDynSel:
+            partitionDynSel.initCheckboxController("Partition reads by annotated regions")
+            partitionDisplay = partitionDynSel.initDisplay(1, "Partitioning")
+            partitionDisplay.createFileSelector("Annotation bed file:", 0, ("Bed Files", ".bed"))
+            partitionDisplay.createDropdown("Partition by:", 1, 0, ("Region", "Strand"))
 
     # Get the input for the findEnrichedIndices function
     bedFilePaths = dialog.selections.getFilePathGroups()[0]
@@ -296,10 +428,28 @@ def main():
     countDipys = dialog.selections.getToggleStates()[1]
     getSecondPlace = dialog.selections.getToggleStates()[2]
     outputBulkFrequencies = dialog.selections.getToggleStates()[3]
+    bulkFrequencyFormat = {"Wide TSV":BulkFrequencyFormat.wideTSV, "Long TSV":BulkFrequencyFormat.longTSV,
+                           "NPZ":BulkFrequencyFormat.npz}[dialog.selections.getDropdownSelections()[0]]
+    if dialog.selections.getToggleStates()[4]: bootstrapReplicates = defaultBootstrapReplicates
+    else: bootstrapReplicates = 0
+    if dialog.selections.getToggleStates()[5]: readSizeRange = None
+    else: readSizeRange = range(16,36)
+    minReadsPerLength = int(dialog.selections.getTextEntries()[0])
+
+    if partitionDynSel.getControllerVar():
+        annotationBedFilePath = dialog.selections.getIndividualFilePaths("Partitioning")[0]
+        partitionScheme = {"Region":PartitionScheme.region,
+                           "Strand":PartitionScheme.strand}[dialog.selections.getDropdownSelections("Partitioning")[0]]
+    else:
+        annotationBedFilePath = None
+        partitionScheme = PartitionScheme.region
 
     findEnrichedIndices(bedFilePaths, genomeFastaFilePath, fastaFilePaths,
-                        countIndividualBases, countDipys, getSecondPlace,
-                        outputBulkFrequencies = outputBulkFrequencies)
+                        countIndividualBases, countDipys, getSecondPlace, readSizeRange = readSizeRange,
+                        minReadsPerLength = minReadsPerLength,
+                        outputBulkFrequencies = outputBulkFrequencies, bulkFrequencyFormat = bulkFrequencyFormat,
+                        bootstrapReplicates = bootstrapReplicates, annotationBedFilePath = annotationBedFilePath,
+                        partitionScheme = partitionScheme)
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -0,0 +1,278 @@
+# This script runs the enriched indices search on many samples at once, combining the results into a single matrix.
+import os, io, subprocess
+import numpy as np
+from multiprocessing import Pool
+from typing import Dict, List
+from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs, getTempDir
+from benbiohelpers.CustomErrors import MetadataAutoGenerationError, MetadataPathError
+from xrlesionfinder.ProjectManagement.UsefulFileSystemFunctions import getDataDirectory
+from xrlesionfinder.ProjectManagement.XRLFMetadata import XRLFMetadata, XRLFMFID
+from xrlesionfinder.ReadBatch import ReadBatch
+from xrlesionfinder.FileScanning import parseIntegers
+from xrlesionfinder.SequenceEnrichmentSearch.ReadLengthHistogram import getAutomaticReadSizes
+from xrlesionfinder.SequenceEnrichmentSearch.FindEnrichedIndices import BaseFrequencyTable, getReadSequencesByLength
+
+
+individualBaseFeatures = ('A','C','G','T')
+dipyFeatures = ("CC","CT","TC","TT","dipys")
+
+
+def getSampleLabel(filePath):
+    """
+    Derive a sample label from the given bed or fasta file's name using XRLFMetadata.
+    If the metadata cannot be derived, the file's basename (sans extension) is used instead.
+    """
+
+    try: metadata = XRLFMetadata(filePath)
+    except (MetadataAutoGenerationError, MetadataPathError):
+        return os.path.basename(filePath).rsplit('.',1)[0]
+
+    if metadata[XRLFMFID.ALT_ID] is not None: return metadata[XRLFMFID.ALT_ID]
+    return '_'.join(str(metadata[featureID]) for featureID in
+                    (XRLFMFID.CELL_TYPE, XRLFMFID.LESION, XRLFMFID.TIMEPOINT, XRLFMFID.REPETITION))
+
+
+def getSampleLabels(filePaths: List[str]):
+    """
+    Get a unique label for each given file path, falling back on file basenames where labels would be duplicated.
+    If basenames are also duplicated, they are prefixed with their parent directory's name, and any labels which
+    still collide are numbered in the order they were given.
+    """
+
+    sampleLabels = [getSampleLabel(filePath) for filePath in filePaths]
+    for i, filePath in enumerate(filePaths):
+        if sampleLabels.count(sampleLabels[i]) > 1:
+            sampleLabels[i] = os.path.basename(filePath).rsplit('.',1)[0]
+
+    basenameLabels = list(sampleLabels)
+    for i, filePath in enumerate(filePaths):
+        if basenameLabels.count(basenameLabels[i]) > 1:
+            sampleLabels[i] = os.path.basename(os.path.dirname(os.path.abspath(filePath))) + '_' + basenameLabels[i]
+
+    parentDirLabels = list(sampleLabels)
+    for i in range(len(filePaths)):
+        if parentDirLabels.count(parentDirLabels[i]) > 1:
+            sampleLabels[i] = f"{parentDirLabels[i]}_{parentDirLabels[:i].count(parentDirLabels[i]) + 1}"
+
+    return sampleLabels
+
+
+def writeCombinedBedFile(bedFilePaths: List[str], combinedBedFilePath):
+    "Combines the given bed files into one, replacing the name column of each read with the index of its bed file."
+    with open(combinedBedFilePath, 'w') as combinedBedFile:
+        for sampleIndex, bedFilePath in enumerate(bedFilePaths):
+            sampleName = str(sampleIndex)
+            with open(bedFilePath, 'r') as bedFile:
+                for line in bedFile:
+                    if line.startswith('#') or line.startswith("track") or line.startswith("browser") or not line.strip(): continue
+                    splitLine = line.rstrip('\r\n').split('\t', 4)
+                    splitLine[3:4] = [sampleName]
+                    combinedBedFile.write('\t'.join(splitLine) + '\n')
+
+
+def splitCombinedFasta(combinedFastaFilePath, sampleCount, readSizeRange):
+    """
+    Given a fasta file converted from a combined bed file (with sample indices as read names), return a list with
+    the offsets and lengths of each sample's reads (with lengths in readSizeRange) in the fasta file.
+    """
+
+    # Since bedtools writes each sequence on a single line, the batch's offsets point directly into the fasta file.
+    readBatch = ReadBatch.fromFastaFile(combinedFastaFilePath, readSizeRange, keepHeaders = True)
+
+    # Each header starts with its read's sample index, followed by "::" or the strand.
+    # Find the length of each index by checking for digits one column at a time.
+    digits = np.frombuffer(b"0123456789", dtype = np.uint8)
+    maxIndexLength = len(str(sampleCount - 1))
+    indexLengths = np.full(len(readBatch), maxIndexLength + 1, dtype = np.int64)
+    for digitOffset in range(maxIndexLength, -1, -1):
+        isDigit = ((digitOffset < readBatch.headerLengths) &
+                   np.isin(readBatch.buffer[np.minimum(readBatch.headerOffsets + digitOffset, len(readBatch.buffer) - 1)], digits))
+        indexLengths[~isDigit] = digitOffset
+    sampleIndices, isValid = parseIntegers(readBatch.buffer, readBatch.headerOffsets, readBatch.headerOffsets + indexLengths)
+    assert np.all(isValid & (sampleIndices < sampleCount)), "Unexpected read name in combined fasta file."
+
+    # Group the reads by sample (keeping their order within each sample).
+    readOrder = np.argsort(sampleIndices, kind = "stable")
+    sampleBounds = np.searchsorted(sampleIndices[readOrder], np.arange(sampleCount + 1))
+    return [(readBatch.offsets[readOrder[sampleBounds[i]:sampleBounds[i+1]]],
+             readBatch.lengths[readOrder[sampleBounds[i]:sampleBounds[i+1]]]) for i in range(sampleCount)]
+
+
+def convertBedFilesToFasta(bedFilePaths: List[str], genomeFastaFilePath, outputFilePathPrefix, readSizeRange):
+    """
+    Converts all the given bed files to fasta format with a single bedtools run against the genome, so the genome
+    only needs to be read once. Returns the path to the combined fasta file, along with a list of the offsets and
+    lengths of each bed file's reads (with lengths in readSizeRange) in that file.
+    """
+
+    tmpDir = getTempDir(outputFilePathPrefix)
+    checkDirs(tmpDir)
+    combinedFilePathPrefix = os.path.join(tmpDir, os.path.basename(outputFilePathPrefix) + "_combined_samples")
+
+    print(f"Converting {len(bedFilePaths)} bed files to fasta format...")
+    writeCombinedBedFile(bedFilePaths, combinedFilePathPrefix + ".bed")
+    try:
+        subprocess.run(("bedtools", "getfasta", "-s", "-name", "-fi", genomeFastaFilePath,
+                        "-bed", combinedFilePathPrefix + ".bed", "-fo", combinedFilePathPrefix + ".fa"), check = True)
+    finally: os.remove(combinedFilePathPrefix + ".bed")
+
+    return combinedFilePathPrefix + ".fa", splitCombinedFasta(combinedFilePathPrefix + ".fa", len(bedFilePaths), readSizeRange)
+
+
+def getSampleFrequencies(fastaFilePath, readOffsets, readLengths, features: List[str], readSizeRange,
+                         fromStartValues, fromEndValues, countIndividualBases, countDipys):
+    """
+    Count the features in a single sample. If readOffsets and readLengths are given, the sample is made up of
+    the reads at those locations in the fasta file (e.g. one bed file's reads in the combined fasta file).
+    Otherwise, the sample is every read in the fasta file.
+    Returns a tuple of:
+    - An array of read counts for each sequence length
+    - An array of frequencies with dimensions sequence length x position x feature
+    - A list of dictionaries (one for each sequence length) of the max frequency info for each reported feature.
+    """
+
+    allSearchValues = list(fromStartValues) + ([-value for value in fromEndValues][::-1])
+    if readOffsets is None: sequencesByLength = getReadSequencesByLength(fastaFilePath, readSizeRange)
+    else: sequencesByLength = ReadBatch.fromFileOffsets(fastaFilePath, readOffsets, readLengths).splitByLength(readSizeRange)
+
+    readCounts = np.array([len(sequencesByLength[sequenceLength]) for sequenceLength in readSizeRange], dtype = int)
+    frequencies = np.zeros((len(readSizeRange), len(allSearchValues), len(features)))
+    maxFrequencyInfo: List[Dict[str,tuple]] = list()
+
+    trackedFeatures = list()
+    if countIndividualBases: trackedFeatures.append((BaseFrequencyTable.TrackedFeature.singleBase, individualBaseFeatures))
+    if countDipys: trackedFeatures.append((BaseFrequencyTable.TrackedFeature.dipys, ("dipys",)))
+
+    for i, sequenceLength in enumerate(readSizeRange):
+
+        baseFrequencies: Dict[str, Dict[int, float]] = dict()
+        maxFrequencyInfo.append(dict())
+
+        for trackedFeature, reportedFeatures in trackedFeatures:
+            baseFrequencyTable = BaseFrequencyTable(fromStartValues, fromEndValues, trackedFeature)
+            baseFrequencyTable.generateBaseFrequencyTable(sequencesByLength[sequenceLength])
+            baseFrequencies.update(baseFrequencyTable.getBaseFrequencies())
+            for feature in reportedFeatures:
+                maxFrequencyInfo[i][feature] = baseFrequencyTable.getMaxFrequencyAndPos(feature)
+
+        frequencies[i] = [[baseFrequencies[feature][position] for feature in features] for position in allSearchValues]
+
+    return (readCounts, frequencies, maxFrequencyInfo)
+
+
+def findEnrichedIndicesForSamples(bedFilePaths: List[str], genomeFastaFilePath, fastaFilePaths: List[str],
+                                  outputFilePathPrefix, countIndividualBases, countDipys,
+                                  readSizeRange = range(16,36), fromStartValues = range(0,0), fromEndValues = range(1,16),
+                                  readSizeCoverageFraction = 0.95, minReadsPerLength = 0, histogramSampleSizeMB = None,
+                                  workerCount = None):
+    """
+    Given many bed and/or fasta files, count features as in findEnrichedIndices, but combine the results for all samples.
+    All bed files are converted to fasta format together, with a single bedtools run against the genome, and all samples
+    are then counted through a single pool of worker processes (workerCount defaults to the number of CPUs).
+    Two files are written, using the given output file path prefix:
+    - A compressed NumPy (.npz) file containing the sample labels and file paths, sequence lengths, positions, features,
+      read counts (sample x sequence length), and frequencies (sample x sequence length x position x feature)
+    - A summary TSV file with the read count and max frequency info for every sample and sequence length.
+    Sample labels are derived from file names using XRLFMetadata.
+    If readSizeRange is None or minReadsPerLength is greater than 0, the read sizes are chosen from a read length histogram
+    combined across all samples, as in findEnrichedIndices.
+    """
+
+    allSearchValues = list(fromStartValues) + ([-value for value in fromEndValues][::-1])
+    features = list()
+    reportedFeatures = list()
+    if countIndividualBases:
+        features += individualBaseFeatures
+        reportedFeatures += individualBaseFeatures
+    if countDipys:
+        features += dipyFeatures
+        reportedFeatures.append("dipys")
+    assert features, "No features were requested for counting."
+
+    sampleFilePaths = list(bedFilePaths) + list(fastaFilePaths)
+    sampleLabels = getSampleLabels(sampleFilePaths)
+
+    # If necessary, use a quick read length histogram to choose the read sizes to analyze.
+    if readSizeRange is None or minReadsPerLength > 0:
+        readSizeRange = getAutomaticReadSizes(sampleFilePaths, readSizeRange, readSizeCoverageFraction,
+                                              minReadsPerLength, histogramSampleSizeMB)
+    assert readSizeRange, "No read sizes to analyze."
+
+    # Convert all the bed files to fasta format at once, and find each bed file's reads in the combined fasta file.
+    if bedFilePaths:
+        combinedFastaFilePath, bedReadLocations = convertBedFilesToFasta(bedFilePaths, genomeFastaFilePath,
+                                                                         outputFilePathPrefix, readSizeRange)
+    sampleReads = ([(combinedFastaFilePath, readOffsets, readLengths) for readOffsets, readLengths in bedReadLocations]
+                   if bedFilePaths else list())
+    sampleReads += [(fastaFilePath, None, None) for fastaFilePath in fastaFilePaths]
+
+    # Count features in all samples through the same worker pool.
+    print(f"Counting features in {len(sampleFilePaths)} samples...")
+    sampleArgs = [sampleReadsArgs + (features, readSizeRange, fromStartValues, fromEndValues, countIndividualBases, countDipys)
+                  for sampleReadsArgs in sampleReads]
+    try:
+        with Pool(workerCount) as pool:
+            sampleResults = pool.starmap(getSampleFrequencies, sampleArgs)
+    finally:
+        if bedFilePaths: os.remove(combinedFastaFilePath)
+
+    # Write the combined matrix.
+    print("Writing Results...")
+    matrixOutputFilePath = outputFilePathPrefix + "_enriched_indices_matrix.npz"
+    np.savez_compressed(matrixOutputFilePath, sampleLabels = np.array(sampleLabels),
+                        sampleFilePaths = np.array(sampleFilePaths),
+                        sequenceLengths = np.array(readSizeRange, dtype = int),
+                        positions = np.array(allSearchValues, dtype = int), features = np.array(features),
+                        readCounts = np.stack([readCounts for readCounts, _, _ in sampleResults]),
+                        frequencies = np.stack([frequencies for _, frequencies, _ in sampleResults]))
+
+    # Write the summary table.
+    summaryOutputFilePath = outputFilePathPrefix + "_enriched_indices_summary.tsv"
+    summaryBuffer = io.StringIO()
+    summaryBuffer.write('\t'.join(["Sample", "Sequence_Length", "Read_Count"] +
+                                  [feature + suffix for feature in reportedFeatures
+                                   for suffix in ("_Max_Frequency", "_Max_Frequency_Position")]) + '\n')
+    for sampleLabel, (readCounts, _, maxFrequencyInfo) in zip(sampleLabels, sampleResults):
+        for i, sequenceLength in enumerate(readSizeRange):
+            summaryBuffer.write('\t'.join([sampleLabel, str(sequenceLength), str(readCounts[i])] +
+                                          [str(value) for feature in reportedFeatures
+                                           for value in maxFrequencyInfo[i][feature]]) + '\n')
+    with open(summaryOutputFilePath, 'w') as summaryOutputFile: summaryOutputFile.write(summaryBuffer.getvalue())
+
+
+def main():
+
+    with TkinterDialog(workingDirectory = getDataDirectory(), title = "Find Enriched Indices for Multiple Samples") as dialog:
+        dialog.createMultipleFileSelector("Bed files of aligned data:", 0, "aligned_reads.bed",
+                                          ("Bed Files", ".bed"))
+        dialog.createGenomeSelector(1, 0)
+        dialog.createMultipleFileSelector("Fasta files of aligned data:", 2, "aligned_reads.fa",
+                                          ("Fasta Files", ".fa"))
+        dialog.createCheckbox("Count individual bases", 3, 0)
+        dialog.createCheckbox("Count dipys", 3, 1)
+        dialog.createFileSelector("Output directory:", 4, ("Directory", ".*"), directory = True)
+        dialog.createTextField("Output name:", 5, 0, defaultText = "multi_sample")
+        dialog.createCheckbox("Automatically choose read lengths", 6, 0)
+        dialog.createTextField("Min reads per length:", 6, 1, defaultText = "0")
+
+    # Get the input for the findEnrichedIndicesForSamples function
+    bedFilePaths = dialog.selections.getFilePathGroups()[0]
+    genomeFastaFilePath = dialog.selections.getGenomes(returnType="fasta")[0]
+    fastaFilePaths = dialog.selections.getFilePathGroups()[1]
+
+    countIndividualBases = dialog.selections.getToggleStates()[0]
+    countDipys = dialog.selections.getToggleStates()[1]
+    if dialog.selections.getToggleStates()[2]: readSizeRange = None
+    else: readSizeRange = range(16,36)
+    minReadsPerLength = int(dialog.selections.getTextEntries()[1])
+
+    outputFilePathPrefix = os.path.join(dialog.selections.getIndividualFilePaths()[0],
+                                        dialog.selections.getTextEntries()[0])
+
+    findEnrichedIndicesForSamples(bedFilePaths, genomeFastaFilePath, fastaFilePaths, outputFilePathPrefix,
+                                  countIndividualBases, countDipys, readSizeRange = readSizeRange,
+                                  minReadsPerLength = minReadsPerLength)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,174 @@
+# This script quickly builds read length histograms from fasta or bed files and uses them to choose which read lengths to analyze.
+# Files are memory-mapped and scanned for record boundaries in chunks using NumPy (see FileScanning), so no Python strings
+# are created for each read.
+import os, mmap
+import numpy as np
+from typing import List
+from benbiohelpers.CustomErrors import InvalidPathError
+from xrlesionfinder.FileScanning import (TAB, FASTA_HEADER_START, chunkSize, getFileChunks, getLineBoundaries,
+                                         parseIntegers)
+
+
+# Bed files are scanned in smaller chunks, since several index arrays (one entry per tab or line) are built for every chunk.
+bedChunkSize = 16*1024*1024
+
+
+def isBedFilePath(filePath: str):
+    "Returns True if the given file is in bed format, and False if it is in fasta format."
+    if filePath.endswith(".bed"): return True
+    elif filePath.endswith(".fa") or filePath.endswith(".fasta"): return False
+    else: raise InvalidPathError(filePath, postPathMessage = "Expected uncompressed fasta or bed file.")
+
+
+def getBedReadLengths(buffer: np.ndarray):
+    "Returns the lengths (end - start) of all the reads in a buffer of complete bed lines. Header lines are ignored."
+
+    lineStarts, lineEnds = getLineBoundaries(buffer)
+    tabPositions = np.flatnonzero(buffer == TAB)
+
+    # Find the tabs surrounding the start and end fields of each line. Lines with fewer than two tabs are ignored.
+    firstTabIndices = np.searchsorted(tabPositions, lineStarts)
+    hasFields = firstTabIndices + 1 < len(tabPositions)
+    lineStarts, lineEnds, firstTabIndices = lineStarts[hasFields], lineEnds[hasFields], firstTabIndices[hasFields]
+    hasFields = tabPositions[firstTabIndices + 1] < lineEnds
+    lineEnds, firstTabIndices = lineEnds[hasFields], firstTabIndices[hasFields]
+
+    startFieldStarts = tabPositions[firstTabIndices] + 1
+    startFieldEnds = tabPositions[firstTabIndices + 1]
+    endFieldStarts = startFieldEnds + 1
+    thirdTabPositions = tabPositions[np.minimum(firstTabIndices + 2, len(tabPositions) - 1)]
+    endFieldEnds = np.where((firstTabIndices + 2 < len(tabPositions)) & (thirdTabPositions < lineEnds),
+                            thirdTabPositions, lineEnds)
+
+    starts, startsAreValid = parseIntegers(buffer, startFieldStarts, startFieldEnds)
+    ends, endsAreValid = parseIntegers(buffer, endFieldStarts, endFieldEnds)
+    isValid = startsAreValid & endsAreValid
+    return (ends - starts)[isValid]
+
+
+def getReadLengthHistogram(filePath, sampleSizeMB = None):
+    """
+    Builds a histogram of read lengths from the given fasta or bed file, returning an array of read counts indexed by length
+    and the fraction of the file that was scanned.
+    If sampleSizeMB is given, only (roughly) that many megabytes from the start of the file are scanned.
+    """
+
+    bedFormat = isBedFilePath(filePath)
+    histogram = np.zeros(1, dtype = np.int64)
+    fileSize = os.path.getsize(filePath)
+    if fileSize == 0: return histogram, 1.0
+
+    scanSize = fileSize
+    if sampleSizeMB is not None: scanSize = min(fileSize, int(sampleSizeMB*1024*1024))
+
+    def addToHistogram(readLengths: np.ndarray):
+        nonlocal histogram
+        chunkHistogram = np.bincount(readLengths.astype(np.int64))
+        if len(chunkHistogram) > len(histogram): histogram = np.pad(histogram, (0, len(chunkHistogram) - len(histogram)))
+        histogram[:len(chunkHistogram)] += chunkHistogram
+
+    with open(filePath, 'rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as fileMap:
+
+        fileBuffer = np.frombuffer(fileMap, dtype = np.uint8)
+        openRecordLength = None # The length of a fasta record which may continue into the next chunk.
+        scannedBytes, chunk = 0, None
+
+        for _, scannedBytes, chunk in getFileChunks(fileMap, fileBuffer, scanSize, bedChunkSize if bedFormat else chunkSize):
+
+            if bedFormat: addToHistogram(getBedReadLengths(chunk))
+
+            else:
+                lineStarts, lineEnds = getLineBoundaries(chunk)
+                isHeader = chunk[lineStarts] == FASTA_HEADER_START
+                headerCount = np.count_nonzero(isHeader)
+
+                # Sum the sequence line lengths for each record. Lines before the first header continue the open record.
+                recordIndices = np.cumsum(isHeader) - 1
+                sequenceLineLengths = (lineEnds - lineStarts)[~isHeader]
+                sequenceRecordIndices = recordIndices[~isHeader]
+                carriedLines = sequenceRecordIndices == -1
+                if openRecordLength is not None: openRecordLength += int(sequenceLineLengths[carriedLines].sum())
+                recordLengths = np.bincount(sequenceRecordIndices[~carriedLines], sequenceLineLengths[~carriedLines],
+                                            minlength = headerCount)
+
+                # Any record whose header was found in this chunk closes the open record.
+                # The last record in this chunk then becomes the open record.
+                if headerCount > 0:
+                    closedRecordLengths = recordLengths[:-1]
+                    if openRecordLength is not None: closedRecordLengths = np.append(closedRecordLengths, openRecordLength)
+                    addToHistogram(closedRecordLengths)
+                    openRecordLength = int(recordLengths[-1])
+
+        # The last open record is only complete if the whole file was scanned.
+        if openRecordLength is not None and scannedBytes >= fileSize: addToHistogram(np.array([openRecordLength]))
+
+        del fileBuffer, chunk
+
+    return histogram, scannedBytes / fileSize
+
+
+def chooseReadSizeRange(histogram: np.ndarray, coverageFraction = 0.95):
+    """
+    Given a histogram of read counts indexed by length, choose the smallest contiguous range of lengths (grown outward
+    from the most common length) that covers at least the given fraction of reads.
+    """
+
+    assert 0 < coverageFraction <= 1, "Coverage fraction must be in the range (0, 1]."
+    totalReads = histogram.sum()
+    if totalReads == 0: return range(0,0)
+
+    lowerLength = upperLength = int(np.argmax(histogram))
+    coveredReads = histogram[lowerLength]
+    while coveredReads < coverageFraction*totalReads:
+        lowerCount = histogram[lowerLength - 1] if lowerLength > 0 else -1
+        upperCount = histogram[upperLength + 1] if upperLength + 1 < len(histogram) else -1
+        if upperCount >= lowerCount:
+            upperLength += 1
+            coveredReads += upperCount
+        else:
+            lowerLength -= 1
+            coveredReads += lowerCount
+
+    return range(lowerLength, upperLength + 1)
+
+
+def getReadSizesFromHistogram(histogram: np.ndarray, readSizeRange = None, coverageFraction = 0.95,
+                              minReadsPerLength = 0) -> List[int]:
+    """
+    Given a histogram of read counts indexed by length, return a list of read lengths to analyze.
+    If readSizeRange is None, it is chosen to cover the given fraction of reads.
+    Lengths with fewer than minReadsPerLength reads are then removed, since they are too sparse to be meaningful.
+    (By default, minReadsPerLength is 0, so no lengths are removed.)
+    """
+
+    if readSizeRange is None:
+        readSizeRange = chooseReadSizeRange(histogram, coverageFraction)
+        print(f"Chose read lengths {readSizeRange.start}-{readSizeRange.stop - 1} "
+              f"to cover {coverageFraction:.0%} of reads.")
+
+    readSizes = [readSize for readSize in readSizeRange
+                 if minReadsPerLength <= 0 or (readSize < len(histogram) and histogram[readSize] >= minReadsPerLength)]
+    skippedReadSizes = [readSize for readSize in readSizeRange if readSize not in readSizes]
+    if skippedReadSizes: print(f"Skipping sparse read lengths: {', '.join(str(readSize) for readSize in skippedReadSizes)}")
+
+    return readSizes
+
+
+def getAutomaticReadSizes(filePaths: List[str], readSizeRange = None, coverageFraction = 0.95,
+                          minReadsPerLength = 0, sampleSizeMB = None) -> List[int]:
+    """
+    Builds a combined read length histogram for the given fasta and/or bed files and returns a list of read lengths
+    to analyze, as in getReadSizesFromHistogram. (Read counts are estimated if only part of each file is scanned.)
+    """
+
+    histogram = np.zeros(1, dtype = np.int64)
+    for filePath in filePaths:
+        print(f"Building read length histogram for {os.path.basename(filePath)}...")
+        fileHistogram, scannedFraction = getReadLengthHistogram(filePath, sampleSizeMB)
+
+        # Estimate the counts for the whole file if only part of it was scanned.
+        fileHistogram = np.round(fileHistogram / scannedFraction).astype(np.int64)
+        if len(fileHistogram) > len(histogram): histogram = np.pad(histogram, (0, len(fileHistogram) - len(histogram)))
+        histogram[:len(fileHistogram)] += fileHistogram
+
+    return getReadSizesFromHistogram(histogram, readSizeRange, coverageFraction, minReadsPerLength)
@@ -0,0 +1,222 @@
+# This script partitions reads by their overlap with annotated genomic regions (e.g. genes or TSSs), and optionally
+# by whether they fall on the transcribed or non-transcribed strand of those regions.
+# Annotations are stored as sorted, merged interval arrays for each chromosome and queried with searchsorted.
+import numpy as np
+from enum import Enum
+from typing import Dict, List
+from benbiohelpers.CustomErrors import checkIfPathExists, UserInputError
+from xrlesionfinder.ReadBatch import ReadBatch
+from xrlesionfinder.FileScanning import TAB, parseIntegers
+
+
+SPACE = ord(' ')
+COLON = ord(':')
+DASH = ord('-')
+OPEN_PARENTHESIS = ord('(')
+CLOSE_PARENTHESIS = ord(')')
+PLUS = ord('+')
+MINUS = ord('-')
+NO_STRAND = ord('.')
+
+# The number of read headers parsed at once when partitioning reads.
+headerBlockSize = 1000000
+
+
+class PartitionScheme(Enum):
+    """
+    Defines how reads are partitioned.
+    - region: Reads inside vs. outside the annotated regions.
+    - strand: Reads on the transcribed vs. non-transcribed strand of the annotated regions (or outside them).
+      Following the XR-seq convention, reads come from the damaged strand, so a read on the opposite strand
+      from its region is on the transcribed strand. Reads overlapping regions on both strands (or reads without
+      strand information) are considered ambiguous.
+    """
+    region = 1
+    strand = 2
+
+    def getPartitionNames(self) -> List[str]:
+        if self == PartitionScheme.region: return ["inside_regions", "outside_regions"]
+        else: return ["transcribed_strand", "non_transcribed_strand", "ambiguous_strand", "outside_regions"]
+
+
+class AnnotationIntervalIndex:
+    """
+    Indexes the regions in an annotation bed file by chromosome and strand.
+    Overlapping regions are merged, so each chromosome's regions are stored as sorted, disjoint start and end arrays.
+    """
+
+    def __init__(self, annotationBedFilePath):
+
+        checkIfPathExists(annotationBedFilePath)
+
+        # Read in the regions for each chromosome and strand. ('.' holds regions from all strands.)
+        regions: Dict[str, Dict[str, List[tuple]]] = dict()
+        with open(annotationBedFilePath, 'r') as annotationBedFile:
+            for line in annotationBedFile:
+                if line.startswith('#') or line.startswith("track") or line.startswith("browser") or not line.strip(): continue
+                splitLine = line.strip().split('\t')
+                chromosome, start, end = splitLine[0], int(splitLine[1]), int(splitLine[2])
+                strand = splitLine[5] if len(splitLine) > 5 else '.'
+                chromosomeRegions = regions.setdefault(chromosome, {'.':list(), '+':list(), '-':list()})
+                chromosomeRegions['.'].append((start, end))
+                if strand in ('+', '-'): chromosomeRegions[strand].append((start, end))
+
+        # Convert the regions to merged interval arrays.
+        self.intervals: Dict[str, Dict[str, tuple]] = dict()
+        for chromosome in regions:
+            self.intervals[chromosome] = dict()
+            for strand, strandRegions in regions[chromosome].items():
+                self.intervals[chromosome][strand] = self.getMergedIntervals(np.array(strandRegions, dtype = np.int64).reshape(-1, 2))
+
+
+    @staticmethod
+    def getMergedIntervals(regions: np.ndarray):
+        "Given an array of (start, end) pairs, return sorted arrays of the starts and ends of the merged regions."
+
+        if len(regions) == 0: return (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))
+
+        regions = regions[np.argsort(regions[:,0], kind = "stable")]
+        starts, ends = regions[:,0], regions[:,1]
+        runningEnds = np.maximum.accumulate(ends)
+        isNewInterval = np.concatenate(([True], starts[1:] > runningEnds[:-1]))
+        newIntervalIndices = np.flatnonzero(isNewInterval)
+        return (starts[newIntervalIndices], np.maximum.reduceat(ends, newIntervalIndices))
+
+
+    def containsPositions(self, chromosome, positions: np.ndarray, strand = '.'):
+        "Return a boolean array showing which of the given 0-based positions fall within a region on the given chromosome and strand."
+
+        if chromosome not in self.intervals: return np.zeros(len(positions), dtype = bool)
+        starts, ends = self.intervals[chromosome][strand]
+        if len(starts) == 0: return np.zeros(len(positions), dtype = bool)
+
+        intervalIndices = np.searchsorted(starts, positions, side = "right") - 1
+        return (intervalIndices >= 0) & (positions < ends[np.maximum(intervalIndices, 0)])
+
+
+def getLastPositionsBefore(positions: np.ndarray, limits: np.ndarray):
+    "Given sorted positions, return the last position before each of the given limits, or -1 if there is none."
+    positions = np.concatenate(([-1], positions))
+    return positions[np.searchsorted(positions, limits, side = "left") - 1]
+
+
+def getReadLocations(readBatch: ReadBatch):
+    """
+    Parse the genomic location of every read in the batch from its fasta header, as produced by bedtools getfasta
+    (e.g. "chr1:100-130(+)", optionally preceded by a name and "::"). Headers are parsed in blocks, directly from the
+    batch's buffer, using vectorized NumPy operations. Returns a tuple of:
+    - An array of chromosome codes for each read
+    - A list of chromosome names, indexed by chromosome code
+    - An array of each read's midpoint
+    - An array of each read's strand as a uint8 character code ('.' if the strand is not given)
+    """
+
+    assert readBatch.headerOffsets is not None, "Partitioning requires read headers."
+    chromosomeCodesByName: Dict[str, int] = dict()
+    chromosomeCodes = np.zeros(len(readBatch), dtype = np.int64)
+    midpoints = np.zeros(len(readBatch), dtype = np.int64)
+    strands = np.full(len(readBatch), NO_STRAND, dtype = np.uint8)
+
+    for blockStart in range(0, len(readBatch), headerBlockSize):
+
+        blockEnd = min(blockStart + headerBlockSize, len(readBatch))
+        headerLengths = readBatch.headerLengths[blockStart:blockEnd]
+
+        # Copy the block's headers into one contiguous array. (A trailing zero byte keeps lookups in bounds for empty headers.)
+        headerStarts = np.cumsum(headerLengths) - headerLengths
+        headerBytes = readBatch.buffer[np.repeat(readBatch.headerOffsets[blockStart:blockEnd] - headerStarts, headerLengths) +
+                                       np.arange(headerLengths.sum(), dtype = np.int64)]
+        headerBytes = np.append(headerBytes, np.uint8(0))
+
+        # Only the first word of each header holds the location.
+        whitespacePositions = np.append(np.flatnonzero((headerBytes == SPACE) | (headerBytes == TAB)), len(headerBytes))
+        locationEnds = np.minimum(whitespacePositions[np.searchsorted(whitespacePositions, headerStarts)],
+                                  headerStarts + headerLengths)
+
+        # Find the strand, if it is given, and the characters separating the chromosome, start, and end.
+        hasStrand = ((locationEnds - headerStarts >= 3) &
+                     (headerBytes[np.maximum(locationEnds - 1, 0)] == CLOSE_PARENTHESIS) &
+                     (headerBytes[np.maximum(locationEnds - 3, 0)] == OPEN_PARENTHESIS))
+        strands[blockStart:blockEnd][hasStrand] = headerBytes[locationEnds[hasStrand] - 2]
+        spanEnds = np.where(hasStrand, locationEnds - 3, locationEnds)
+
+        colonPositions = np.flatnonzero(headerBytes == COLON)
+        colons = getLastPositionsBefore(colonPositions, spanEnds)
+        dashes = getLastPositionsBefore(np.flatnonzero(headerBytes == DASH), spanEnds)
+        nameSeparators = getLastPositionsBefore(colonPositions[:-1][np.diff(colonPositions) == 1], colons - 1)
+        chromosomeStarts = np.where(nameSeparators >= headerStarts, nameSeparators + 2, headerStarts)
+
+        starts, startsAreValid = parseIntegers(headerBytes, colons + 1, dashes)
+        ends, endsAreValid = parseIntegers(headerBytes, dashes + 1, spanEnds)
+        isValid = (colons > chromosomeStarts) & (dashes > colons) & startsAreValid & endsAreValid
+        if not np.all(isValid):
+            raise UserInputError(f"Unable to parse a genomic location from the fasta header "
+                                 f"\"{readBatch.getHeader(blockStart + int(np.argmin(isValid)))}\". "
+                                 "Partitioning requires headers of the form \"chr:start-end(strand)\".")
+        midpoints[blockStart:blockEnd] = (starts + ends)//2
+
+        # Gather the chromosome names into a fixed-width byte string array, one column at a time,
+        # and give each unique name a code.
+        chromosomeWidths = colons - chromosomeStarts
+        chromosomeMatrix = np.zeros((len(headerLengths), int(chromosomeWidths.max())), dtype = np.uint8)
+        for column in range(chromosomeMatrix.shape[1]):
+            inName = column < chromosomeWidths
+            chromosomeMatrix[inName, column] = headerBytes[chromosomeStarts[inName] + column]
+        uniqueChromosomes, chromosomeIndices = np.unique(chromosomeMatrix.view(f"S{chromosomeMatrix.shape[1]}").ravel(),
+                                                         return_inverse = True)
+        blockChromosomeCodes = np.array([chromosomeCodesByName.setdefault(chromosome.decode("ascii"), len(chromosomeCodesByName))
+                                         for chromosome in uniqueChromosomes], dtype = np.int64)
+        chromosomeCodes[blockStart:blockEnd] = blockChromosomeCodes[chromosomeIndices.ravel()]
+
+    return chromosomeCodes, list(chromosomeCodesByName), midpoints, strands
+
+
+class ReadPartitioner:
+    """
+    Assigns reads to partitions based on the location of each read's midpoint relative to the regions in an annotation bed file.
+    """
+
+    def __init__(self, annotationBedFilePath, partitionScheme = PartitionScheme.region):
+        assert partitionScheme in PartitionScheme, "Unrecognized partition scheme: " + str(partitionScheme)
+        self.partitionScheme = partitionScheme
+        print("Indexing annotation regions...")
+        self.intervalIndex = AnnotationIntervalIndex(annotationBedFilePath)
+
+
+    def partitionReads(self, readBatch: ReadBatch) -> Dict[str, ReadBatch]:
+        """
+        Split the given reads (which must have headers giving their genomic locations) into partitions.
+        Returns a dictionary of read batches (sharing the given batch's buffer) with partition names as keys.
+        """
+
+        # Get the location of each read from its header.
+        chromosomeCodes, chromosomeNames, midpoints, readStrands = getReadLocations(readBatch)
+
+        # Find which reads fall within regions on either strand, one chromosome at a time.
+        # Reads are grouped by chromosome once, so each chromosome's reads are a single slice of the sorted read order.
+        inRegion = np.zeros(len(readBatch), dtype = bool)
+        inPlusRegion = np.zeros(len(readBatch), dtype = bool)
+        inMinusRegion = np.zeros(len(readBatch), dtype = bool)
+        readOrder = np.argsort(chromosomeCodes, kind = "stable")
+        chromosomeBounds = np.searchsorted(chromosomeCodes[readOrder], np.arange(len(chromosomeNames) + 1))
+        for chromosomeCode, chromosome in enumerate(chromosomeNames):
+            onChromosome = readOrder[chromosomeBounds[chromosomeCode]:chromosomeBounds[chromosomeCode + 1]]
+            inRegion[onChromosome] = self.intervalIndex.containsPositions(chromosome, midpoints[onChromosome])
+            if self.partitionScheme == PartitionScheme.strand:
+                inPlusRegion[onChromosome] = self.intervalIndex.containsPositions(chromosome, midpoints[onChromosome], '+')
+                inMinusRegion[onChromosome] = self.intervalIndex.containsPositions(chromosome, midpoints[onChromosome], '-')
+
+        if self.partitionScheme == PartitionScheme.region:
+            partitionMasks = {"inside_regions":inRegion, "outside_regions":~inRegion}
+
+        elif self.partitionScheme == PartitionScheme.strand:
+            onPlusRead = readStrands == PLUS
+            onMinusRead = readStrands == MINUS
+            onPlusOnly = inPlusRegion & ~inMinusRegion
+            onMinusOnly = inMinusRegion & ~inPlusRegion
+            transcribed = (onPlusOnly & onMinusRead) | (onMinusOnly & onPlusRead)
+            nonTranscribed = (onPlusOnly & onPlusRead) | (onMinusOnly & onMinusRead)
+            partitionMasks = {"transcribed_strand":transcribed, "non_transcribed_strand":nonTranscribed,
+                              "ambiguous_strand":inRegion & ~transcribed & ~nonTranscribed, "outside_regions":~inRegion}
+
+        return {partition:readBatch.subset(partitionMasks[partition]) for partition in self.partitionScheme.getPartitionNames()}